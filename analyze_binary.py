@@ -1,153 +1,246 @@
 from collections import namedtuple
 
+import argparse
+import numpy as np
 import pandas as pd
 import os
 from mapping import get_files
 from log_models import PredictionLog, SelectionTable
-from datetime import datetime, timedelta
+from datetime import datetime
 from file_map import FileMap
-from utilities import get_range_overlap, time_overlap
+from utilities import seconds_to_timedelta64, time_overlap
+from intervals import overlap_pairs
+from parallel import map_files, report_errors
+import profiling
+import registry
 
 Range = namedtuple('Range', ['start', 'end'])
 
+parser = argparse.ArgumentParser()
+
+parser.add_argument(
+    "--binary",
+    default="/home/alex/data/KARAN_ODOM/predict_1",
+    help="Directory with the binary prediction logs",
+)
+
+parser.add_argument(
+    "--file_map",
+    default="results/file_map.json",
+    help="File map written by mapping.py",
+)
+
+parser.add_argument(
+    "--results",
+    default="/home/alex/data/KARAN_ODOM/analysis/results",
+    help="Directory with the positive prediction CSVs to compare against the ground truth",
+)
+
+parser.add_argument(
+    "--format",
+    dest="file_format",
+    choices=["csv", "parquet"],
+    default="csv",
+    help="File format of the raw/positive prediction exports. Parquet needs pyarrow. Default csv",
+)
+
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes writing the prediction CSVs of different logs, 0 uses every CPU. Default 1",
+)
+
+profiling.add_arguments(parser)
+
+
 def get_gt_from_binary_log(log: PredictionLog, file_map: FileMap):
-    for (k, v) in file_map.gt_pred_map.items():
-        if log.log_file in v.keys():
-            return SelectionTable(k)
-    return None
+    gt_file = file_map.get_gt_file(log.log_file)
+    if gt_file is None:
+        return None
+    return registry.get_table(gt_file)
 
 
-def raw_prediction_to_csv(log: PredictionLog, file_map: FileMap):
+# Columns repeating one value for every row of a file, stored dictionary encoded in Parquet.
+FILE_COLUMNS = ["log_file", "audio_file", "gt_file"]
+
+
+class _PredictionWriter:
+    """Writes the rows of one prediction export chunk by chunk, as CSV or Parquet."""
+
+    def __init__(self, output, file_format="csv"):
+        self.output = output
+        self.file_format = file_format
+        self.written = False
+        self._parquet = None
+
+    def write(self, df):
+        if self.file_format == "parquet":
+            self._write_parquet(df)
+        else:
+            df.to_csv(self.output, index=False, mode="a" if self.written else "w", header=not self.written)
+        self.written = True
+
+    def _write_parquet(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        for column in FILE_COLUMNS:
+            df[column] = df[column].astype("category")
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._parquet is None:
+            self._parquet = pq.ParquetWriter(self.output, table.schema)
+        self._parquet.write_table(table.cast(self._parquet.schema))
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+
+
+def _output_path(prefix, log: PredictionLog, file_format):
+    return f"results/{prefix}_{os.path.basename(log.log_file.replace('.log', '.' + file_format))}"
+
+
+def _prediction_frame(log: PredictionLog, table: SelectionTable, start_t, end_t):
+    """Leading columns of the prediction exports for frames or events starting/ending at `start_t`/`end_t`.
+
+    Times are in seconds from the start of the log, the absolute and relative times on the
+    audio and ground truth clock are computed for all rows at once.
+    """
+    log_start = np.datetime64(log.start_date_time, "us")
+    table_start = np.datetime64(table.start_date_time, "us")
+    offset = (log.start_date_time - table.start_date_time).total_seconds()
+    abs_gt_time_start = table_start + seconds_to_timedelta64(start_t + offset)
+    abs_gt_time_end = table_start + seconds_to_timedelta64(end_t + offset)
+    return pd.DataFrame({
+        "log_file": log.log_file,
+        "audio_file": log.audio_file,
+        "gt_file": table.file_path,
+        "rel_time_start": start_t,
+        "rel_time_end": end_t,
+        "abs_audio_time_start": log_start + seconds_to_timedelta64(start_t),
+        "abs_audio_time_end": log_start + seconds_to_timedelta64(end_t),
+        "abs_gt_time_start": abs_gt_time_start,
+        "abs_gt_time_end": abs_gt_time_end,
+        "rel_gt_time_start": (abs_gt_time_start - table_start) / np.timedelta64(1, "s"),
+        "rel_gt_time_end": (abs_gt_time_end - table_start) / np.timedelta64(1, "s"),
+    }, index=pd.RangeIndex(len(start_t)))
+
+
+def raw_prediction_to_csv(log: PredictionLog, file_map: FileMap, table: SelectionTable = None, file_format="csv"):
+    """Write the raw frames of the log and return its events, grouped in the same pass over the log."""
 
-    table = get_gt_from_binary_log(log, file_map)
+    if table is None:
+        table = get_gt_from_binary_log(log, file_map)
     if table is None:
         return
-    data = {
-        "log_file": [],
-        "audio_file": [],
-        "gt_file": [],
-        "rel_time_start": [],
-        "rel_time_end": [],
-        "abs_audio_time_start": [],
-        "abs_audio_time_end": [],
-        "abs_gt_time_start": [],
-        "abs_gt_time_end": [],
-        "rel_gt_time_start": [],
-        "rel_gt_time_end": [],
-        "pred": [],
-        "class_id": [],
-        "prob": []
-    }
-
-    for d in log.data:
-        data["log_file"].append(log.log_file)
-        data["audio_file"].append(log.audio_file)
-        data["gt_file"].append(table.file_path)
-        data["rel_time_start"].append(d['start_t'])
-        data["rel_time_end"].append(d['end_t'])
-        data["pred"].append(d['pred'])
-        data["class_id"].append(d['class_id'])
-        data["prob"].append(d['prob'])
-        data["abs_audio_time_start"].append(log.start_date_time + timedelta(seconds=d['start_t']))
-        data["abs_audio_time_end"].append(log.start_date_time + timedelta(seconds=d['end_t']))
-        abs_gt_time_start = table.start_date_time + timedelta(seconds=d['start_t'] + (log.start_date_time - table.start_date_time).total_seconds())
-        abs_gt_time_end = table.start_date_time + timedelta(seconds=d['end_t'] + (log.start_date_time - table.start_date_time).total_seconds())
-        data["abs_gt_time_start"].append(abs_gt_time_start)
-
-        data["abs_gt_time_end"].append(abs_gt_time_end)
-        data["rel_gt_time_start"].append((abs_gt_time_start - table.start_date_time).total_seconds())
-        data["rel_gt_time_end"].append((abs_gt_time_end - table.start_date_time).total_seconds())
-
-    df = pd.DataFrame(data)
-    df.to_csv(f"results/raw_{os.path.basename(log.log_file.replace('.log', '.csv'))}", index=False)
-
-
-def positive_prediction_to_csv(log: PredictionLog, file_map: FileMap):
+    writer = _PredictionWriter(_output_path("raw", log, file_format), file_format)
 
-    table = get_gt_from_binary_log(log, file_map)
+    def chunks():
+        for frames in log.iter_chunks():
+            with profiling.stage("build_frame"):
+                df = _prediction_frame(log, table, frames.start_t, frames.end_t)
+                df["pred"] = frames.pred
+                df["class_id"] = frames.pred
+                df["prob"] = frames.prob
+            with profiling.stage("write_predictions"):
+                writer.write(df)
+            profiling.count("raw_prediction_rows", len(df))
+            yield frames
+
+    segments = log.segments(chunks=chunks())
+    if not writer.written:
+        writer.write(_prediction_frame(log, table, np.empty(0), np.empty(0)).assign(pred=[], class_id=[], prob=[]))
+    writer.close()
+    return segments
+
+
+def positive_prediction_to_csv(log: PredictionLog, file_map: FileMap, table: SelectionTable = None, file_format="csv",
+                               segments=None):
+    """Write the events of the log, `segments` if they were already grouped."""
+
+    if table is None:
+        table = get_gt_from_binary_log(log, file_map)
     if table is None:
         return
-    data = {
-        "log_file": [],
-        "audio_file": [],
-        "gt_file": [],
-        "rel_time_start": [],
-        "rel_time_end": [],
-        "abs_audio_time_start": [],
-        "abs_audio_time_end": [],
-        "abs_gt_time_start": [],
-        "abs_gt_time_end": [],
-        "rel_gt_time_start": [],
-        "rel_gt_time_end": [],
-        "class_id": [],
-    }
-
-    for d in log.group():
-        data["log_file"].append(log.log_file)
-        data["audio_file"].append(log.audio_file)
-        data["gt_file"].append(table.file_path)
-        data["rel_time_start"].append(d['start_t'])
-        data["rel_time_end"].append(d['end_t'])
-        data["class_id"].append(d['class_id'])
-        data["abs_audio_time_start"].append(log.start_date_time + timedelta(seconds=d['start_t']))
-        data["abs_audio_time_end"].append(log.start_date_time + timedelta(seconds=d['end_t']))
-        abs_gt_time_start = table.start_date_time + timedelta(seconds=d['start_t'] + (log.start_date_time - table.start_date_time).total_seconds())
-        abs_gt_time_end = table.start_date_time + timedelta(seconds=d['end_t'] + (log.start_date_time - table.start_date_time).total_seconds())
-        data["abs_gt_time_start"].append(abs_gt_time_start)
-
-        data["abs_gt_time_end"].append(abs_gt_time_end)
-        data["rel_gt_time_start"].append((abs_gt_time_start - table.start_date_time).total_seconds())
-        data["rel_gt_time_end"].append((abs_gt_time_end - table.start_date_time).total_seconds())
-
-    df = pd.DataFrame(data)
-    df.to_csv(f"results/positive_{os.path.basename(log.log_file.replace('.log', '.csv'))}", index=False)
-
-
-def count(folder, file_map: FileMap):
+    if segments is None:
+        segments = log.segments()
+    with profiling.stage("build_frame"):
+        df = _prediction_frame(log, table, segments.start_t, segments.end_t)
+        df["class_id"] = segments.class_id
+    with profiling.stage("write_predictions"):
+        writer = _PredictionWriter(_output_path("positive", log, file_format), file_format)
+        writer.write(df)
+        writer.close()
+    profiling.count("positive_prediction_rows", len(df))
+    return len(df)
+
+
+def count_file(file, file_map: FileMap, file_format="csv"):
+    log = registry.get_log(file, stream=True)
+    table = get_gt_from_binary_log(log, file_map)
+    if table is None:
+        # Nothing is written without a ground truth table, the log is only grouped to count its events.
+        events = len(log.segments().start_t)
+    else:
+        with profiling.stage("raw_predictions"):
+            segments = raw_prediction_to_csv(log, file_map, table, file_format)
+        with profiling.stage("positive_predictions"):
+            events = positive_prediction_to_csv(log, file_map, table, file_format, segments)
+    profiling.count("logs")
+    return events
+
+
+def count(folder, file_map: FileMap, workers=1, file_format="csv"):
     files = get_files(folder, "log")
-    predictions = []
-    for file in files:
-        log = PredictionLog(file)
-        raw_prediction_to_csv(log, file_map)
-        positive_prediction_to_csv(log, file_map)
-        preds = log.group()
-        predictions += preds
+    predictions = sum(report_errors(map_files(count_file, files, workers, args=(file_map, file_format))))
+
+    print(predictions)
+
 
-    print(len(predictions))
+def read_predictions(file_path):
+    """Read a raw/positive prediction export written as CSV or Parquet."""
+    if file_path.endswith(".parquet"):
+        return pd.read_parquet(file_path)
+    return pd.read_csv(file_path)
 
 
 def analyze_positives(results_folder):
-    df = pd.concat([pd.read_csv(os.path.join(results_folder, f)) for f in os.listdir(results_folder) if "positive_" in f], axis=0)
-    gt_dfs = []
-    for gt_file in list(df["gt_file"].unique()):
-        gt_df = pd.read_csv(gt_file, sep="\t")
-        gt_df["gt_file"] = gt_file
-        gt_dfs.append(gt_df)
-    gt_dfs = pd.concat(gt_dfs, axis=0)
-    overlaps = {
-        "sel_table": [],
-        "rel_gt_start": [],
-        "rel_gt_end": [],
-        "rel_pred_start": [],
-        "rel_pred_end": []
-    }
-
-    for row in df.itertuples():
-        row_gt = gt_dfs[gt_dfs["gt_file"] == row.gt_file]
-        pred_range = Range(start=row.rel_gt_time_start, end=row.rel_gt_time_end)
-        #pred_range = [row.rel_gt_time_start, row.rel_gt_time_end]
-        for gt_row in row_gt.itertuples():
-            gt_range = Range(start=gt_row[4], end=gt_row[5])
-            # gt_range = [gt_row[4], gt_row[5]]
-            overlap = get_range_overlap(pred_range, gt_range)
-            # overlap = time_overlap(pred_range, gt_range)
-            if overlap > 0:
-                overlaps["sel_table"].append(row.gt_file)
-                overlaps["rel_gt_start"].append(gt_row[4])
-                overlaps["rel_gt_end"].append(gt_row[5])
-                overlaps["rel_pred_start"].append(row.rel_gt_time_start)
-                overlaps["rel_pred_end"].append(row.rel_gt_time_end)
-    overlap_df = pd.DataFrame(overlaps)
+    with profiling.stage("read_predictions"):
+        df = pd.concat([read_predictions(os.path.join(results_folder, f)) for f in os.listdir(results_folder) if "positive_" in f], axis=0)
+    profiling.count("positive_prediction_rows_read", len(df))
+    pred_start = df["rel_gt_time_start"].to_numpy(dtype=np.float64)
+    pred_end = df["rel_gt_time_end"].to_numpy(dtype=np.float64)
+    rows = [np.empty(0, dtype=np.int64)]
+    gt_rows = [np.empty(0, dtype=np.int64)]
+    gt_starts = [np.empty(0)]
+    gt_ends = [np.empty(0)]
+
+    # Each selection table is read once and joined with the positive predictions of its recordings.
+    for gt_file, pred_rows in df.groupby("gt_file", sort=False).indices.items():
+        gt_df = registry.get_table(gt_file).data
+        gt_start = gt_df.iloc[:, 3].to_numpy()
+        gt_end = gt_df.iloc[:, 4].to_numpy()
+        with profiling.stage("overlap"):
+            i, j = overlap_pairs(pred_start[pred_rows], pred_end[pred_rows], gt_start, gt_end)
+        rows.append(pred_rows[i])
+        gt_rows.append(j)
+        gt_starts.append(gt_start[j])
+        gt_ends.append(gt_end[j])
+
+    # Same row order as a loop over the predictions and, for each of them, over its table.
+    rows = np.concatenate(rows)
+    order = np.lexsort((np.concatenate(gt_rows), rows))
+    rows = rows[order]
+    with profiling.stage("build_frame"):
+        overlap_df = pd.DataFrame({
+            "sel_table": df["gt_file"].to_numpy()[rows],
+            "rel_gt_start": np.concatenate(gt_starts)[order],
+            "rel_gt_end": np.concatenate(gt_ends)[order],
+            "rel_pred_start": pred_start[rows],
+            "rel_pred_end": pred_end[rows]
+        })
+    profiling.count("overlaps", len(overlap_df))
     overlap_df.to_csv("results/true_positive_binary_predictions.csv", index=False)
 
 def count_for_tape(files):
@@ -156,7 +249,11 @@ def count_for_tape(files):
 
 
 if __name__ == '__main__':
-    binary = "/home/alex/data/KARAN_ODOM/predict_1"
-    f_map = FileMap("results/file_map.json")
-    count("/home/alex/data/KARAN_ODOM/predict_1", f_map)
-    analyze_positives("/home/alex/data/KARAN_ODOM/analysis/results")
+    ARGS = parser.parse_args()
+    with profiling.session(ARGS):
+        f_map = FileMap(ARGS.file_map)
+        with profiling.stage("count"):
+            count(ARGS.binary, f_map, ARGS.workers, ARGS.file_format)
+        with profiling.stage("analyze_positives"):
+            analyze_positives(ARGS.results)
+    print(registry.summary())
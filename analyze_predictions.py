@@ -17,16 +17,24 @@ def filter_by_sunrise(df, sunrise_times_csv):
 
 def analyze(csv, sunrise_times_csv):
     df = pd.read_csv(csv, parse_dates=["binary_start"])
-    past_sunrise_df = filter_by_sunrise(df, sunrise_times_csv)
+    past_sunrise_df = analyze_frame(df, sunrise_times_csv)
     past_sunrise_df.to_csv(csv.replace("prediction_results.csv", "past_sunrise_prediction_results.csv"), index=False)
-    positives = past_sunrise_df[(~past_sunrise_df["ground_truth_start"].isna()) & (past_sunrise_df["multiclass_prediction"] != 'noise')]
-    negatives = past_sunrise_df[past_sunrise_df["ground_truth_start"].isna() & (past_sunrise_df["multiclass_prediction"] != 'noise')]
+
+
+def analyze_frame(df, sunrise_times_csv):
+    """Print the counts of `analyze` for prediction results already in memory and return the rows past sunrise."""
+    past_sunrise_df = filter_by_sunrise(df, sunrise_times_csv)
+    # Predictions without an annotation have an empty ground truth, NaN once read back from the CSV.
+    unmatched = past_sunrise_df["ground_truth_start"].isna() | (past_sunrise_df["ground_truth_start"] == "")
+    positives = past_sunrise_df[(~unmatched) & (past_sunrise_df["multiclass_prediction"] != 'noise')]
+    negatives = past_sunrise_df[unmatched & (past_sunrise_df["multiclass_prediction"] != 'noise')]
     tps = positives[positives["multiclass_prediction"] == positives["ground_truth"]]
     print(f"Total Predictions: {len(df)}")
     print(f"Predictions where sex is unknown: {len(positives[positives['ground_truth'] == 'u'])}")
     print(f"False Positives: {len(negatives)}")
     print(f"Predictions matching an annotated signal: {len(positives)}")
     print(f"True Positives: {len(tps)}")
+    return past_sunrise_df
 
 
 if __name__ == '__main__':
@@ -0,0 +1,80 @@
+import numpy as np
+import soundfile as sf
+
+import profiling
+
+# Segments closer than this are read with one seek and read call.
+MAX_GAP_S = 2.0
+# Upper bound for the length of a coalesced read, keeps memory flat for dense detections.
+MAX_WINDOW_S = 60.0
+
+
+def sample_ranges(start_t, end_t, sr):
+    """First and end sample of every segment, the same `int(t * sr)` indices a slice of the whole recording uses."""
+    starts = np.array([int(t * sr) for t in np.asarray(start_t, dtype=np.float64).tolist()], dtype=np.int64)
+    stops = np.array([int(t * sr) for t in np.asarray(end_t, dtype=np.float64).tolist()], dtype=np.int64)
+    return starts, stops
+
+
+def coalesce(starts, stops, max_gap, max_window):
+    """Group sample ranges into read windows.
+
+    Returns ``(window_start, window_stop, indices)`` tuples in file order. A range joins
+    the current window if it starts at most `max_gap` samples after the window ends and
+    the window stays within `max_window` samples, a single longer range gets its own window.
+    """
+    windows = []
+    for idx in np.argsort(starts, kind="stable").tolist():
+        start, stop = int(starts[idx]), max(int(stops[idx]), int(starts[idx]))
+        if windows and start - windows[-1][1] <= max_gap and max(stop, windows[-1][1]) - windows[-1][0] <= max_window:
+            window = windows[-1]
+            window[1] = max(window[1], stop)
+            window[2].append(idx)
+        else:
+            windows.append([start, stop, [idx]])
+    return [tuple(window) for window in windows]
+
+
+def read_windows(f, starts, stops, max_gap, max_window):
+    """Read the coalesced windows of the sample ranges from an open `sf.SoundFile`.
+
+    Yields ``(window_start, audio, indices)`` per window, where `audio` holds the samples
+    from `window_start` on, read with the same dtype and shape as ``sf.read`` returns.
+    """
+    for window_start, window_stop, indices in coalesce(starts, stops, max_gap, max_window):
+        window_start = min(window_start, f.frames)
+        with profiling.stage("read_audio"):
+            f.seek(window_start)
+            audio = f.read(max(min(window_stop, f.frames) - window_start, 0), dtype="float64")
+        profiling.count("audio_samples_read", audio.size)
+        yield window_start, audio, indices
+
+
+def iter_windows(audio_file, start_t, end_t, max_gap_s=MAX_GAP_S, max_window_s=MAX_WINDOW_S):
+    """Read the audio of the segments window by window, without loading the whole recording.
+
+    Yields ``(sr, window_start, audio, segments)`` per coalesced window, where `audio` holds
+    the samples from `window_start` on and `segments` lists ``(idx, start, stop)`` sample
+    ranges of its segments, clipped to the audio that was read.
+    """
+    with sf.SoundFile(audio_file) as f:
+        sr = f.samplerate
+        starts, stops = sample_ranges(start_t, end_t, sr)
+        for window_start, audio, indices in read_windows(f, starts, stops, int(max_gap_s * sr), int(max_window_s * sr)):
+            window_stop = window_start + len(audio)
+            segments = []
+            for idx in indices:
+                start = min(int(starts[idx]), window_stop)
+                segments.append((idx, start, max(min(int(stops[idx]), window_stop), start)))
+            yield sr, window_start, audio, segments
+
+
+def iter_segments(audio_file, start_t, end_t, max_gap_s=MAX_GAP_S, max_window_s=MAX_WINDOW_S):
+    """Yield ``(idx, audio, sr)`` for every segment without loading the whole recording.
+
+    ``audio`` equals ``sf.read(audio_file)[0][int(start_t[idx] * sr):int(end_t[idx] * sr)]``.
+    Segments are yielded in file order.
+    """
+    for sr, window_start, audio, segments in iter_windows(audio_file, start_t, end_t, max_gap_s, max_window_s):
+        for idx, start, stop in segments:
+            yield idx, audio[start - window_start:stop - window_start], sr
@@ -0,0 +1,60 @@
+import argparse
+import os
+import time
+from collections import namedtuple
+
+from mapping import build_mapping, get_leading_component
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--tables", type=int, default=50, help="Ground truth tables")
+parser.add_argument("--recordings", type=int, default=20, help="Binary logs (recordings) per table")
+parser.add_argument("--extractions", type=int, default=100, help="Multiclass logs per binary log")
+
+MulticlassLog = namedtuple("MulticlassLog", ["log_file", "audio_file"])
+
+
+def synthetic_tree(tables, recordings, extractions):
+    """File names as they appear in the ground truth, predict_1 and predict_2 directories."""
+    ground_truth, binary, multiclass = [], [], []
+    for t in range(tables):
+        site = f"N{t % 10}_S{t:05d}_2022{5 + t % 3:02d}{1 + t % 28:02d}"
+        ground_truth.append(f"/data/gt/{site}_053000.Table.1.selections.FINAL.txt")
+        for r in range(recordings):
+            wav = f"{site}_{5 + r // 6:02d}{(r % 6) * 10:02d}00.wav"
+            binary.append(f"/data/predict_1/{wav.replace('.wav', '_predict_output.log')}")
+            for e in range(extractions):
+                name = f"target-{e * 1000}ms-{e * 1000 + 750}ms_{e}_{wav}"
+                multiclass.append(MulticlassLog(
+                    log_file=f"/data/predict_2/{name.replace('.wav', '_predict_output.log')}",
+                    audio_file=f"/data/extractions/{name}",
+                ))
+    return ground_truth, binary, multiclass
+
+
+def legacy_mapping(ground_truth_files, binary_files, multiclass_prediction_logs):
+    """The substring scans make_mapping used before the file indexes."""
+    data = {}
+    for gt in ground_truth_files:
+        leading_component = get_leading_component(gt)
+        data[gt] = {}
+        for b in [f for f in binary_files if leading_component in f]:
+            wav_file = os.path.basename(b).replace("_predict_output.log", ".wav")
+            data[gt][b] = [m.log_file for m in multiclass_prediction_logs if wav_file in m.audio_file]
+    return data
+
+
+def main(args):
+    ground_truth, binary, multiclass = synthetic_tree(args.tables, args.recordings, args.extractions)
+    print(f"{len(ground_truth)} tables, {len(binary)} binary logs, {len(multiclass)} multiclass logs")
+    t0 = time.perf_counter()
+    legacy = legacy_mapping(ground_truth, binary, multiclass)
+    legacy_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    indexed = build_mapping(ground_truth, binary, multiclass)[0]
+    indexed_s = time.perf_counter() - t0
+    assert indexed == legacy, "indexed mapping differs from the substring scan"
+    print(f"substring scan {legacy_s:.2f}s | indexed {indexed_s:.3f}s | speedup {legacy_s / indexed_s:.0f}x")
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -0,0 +1,82 @@
+import argparse
+import os
+import tempfile
+import time
+
+import log_models
+from benchmarks.synthetic import write_binary_log
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--frames", type=int, default=1000000, help="Frames in the synthetic binary log")
+parser.add_argument("--repeat", type=int, default=3, help="Timed runs per implementation, the best one is reported")
+
+
+def legacy_group_smooth(data, is_positive):
+    """The frame-by-frame loop `_group_smooth` used before `grouping`, minus its crash on no positives."""
+    grouped = []
+    data = [l for l in data if is_positive(l)]
+    if len(data) == 0:
+        return grouped
+    group = {"start_t": data[0]["start_t"], "end_t": data[0]["end_t"], "class_id": data[0]["class_id"]}
+    for l in data[1:]:
+        if l["class_id"] == group["class_id"] and l["start_t"] < group["end_t"]:
+            group["end_t"] = l["end_t"]
+        elif l["class_id"] != group["class_id"] and l["start_t"] < group["end_t"]:
+            continue
+        else:
+            grouped.append(group)
+            group = {"start_t": l["start_t"], "end_t": l["end_t"], "class_id": l["class_id"]}
+    return grouped
+
+
+def legacy_group_non_smooth(data):
+    """The frame-by-frame loop `_group_non_smooth` used before `grouping`."""
+    grouped = []
+    start_t = 0.0
+    end_t = 0.0
+    class_id = None
+    for line in data:
+        if class_id is None:
+            class_id = line["class_id"]
+            end_t = line["end_t"]
+            continue
+        if line["class_id"] != class_id:
+            grouped.append({"start_t": start_t, "end_t": end_t, "class_id": class_id})
+            start_t = line["start_t"]
+            end_t = line["end_t"]
+            class_id = line["class_id"]
+            continue
+        end_t = line["end_t"]
+    return grouped
+
+
+def best_of(func, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_binary_log(os.path.join(tmp, "N9_S00920_20220516_053000_predict_output.log"),
+                                "/tmp/N9_S00920_20220516_053000.wav", args.frames)
+        log = log_models.PredictionLog(path, use_cache=False)
+        data = log.data
+        for smooth in [True, False]:
+            if smooth:
+                legacy = lambda: legacy_group_smooth(data, lambda l: l["class_id"] == 1)
+            else:
+                legacy = lambda: legacy_group_non_smooth(data)
+            legacy_s, expected = best_of(legacy, args.repeat)
+            vectorized_s, segments = best_of(lambda: log.segments(smooth), args.repeat)
+            assert log.group(smooth) == expected, "vectorized grouping differs from the frame loop"
+            print(f"smooth={smooth}: {args.frames} frames, {len(segments.start_t)} events | "
+                  f"frame loop {legacy_s:.3f}s | vectorized {vectorized_s:.4f}s | "
+                  f"speedup {legacy_s / vectorized_s:.0f}x")
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -0,0 +1,65 @@
+import argparse
+import os
+import subprocess
+import sys
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--repeat", type=int, default=5, help="Imports per entry point, the fastest one is reported")
+parser.add_argument("--target_ms", type=float, default=500,
+                    help="Import time target of segment_extraction for extraction without spectrograms")
+
+# Scripts with a command line, in the order they run in a typical pipeline.
+ENTRY_POINTS = [
+    "mapping",
+    "log_cache",
+    "analyze_binary",
+    "generate_prediction_results",
+    "generate_ground_truth_results",
+    "analyze_predictions",
+    "threshold_sweep",
+    "generate_selection_tables",
+    "generate_selection_tables_from_multiclass_predictions",
+    "segment_extraction",
+    "segment_archive",
+]
+# Dependencies that cost hundreds of milliseconds to seconds to import.
+HEAVY = ["torch", "matplotlib", "pandas", "pyarrow"]
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_time(module):
+    """Cumulative import time of `module` in microseconds and the top level packages it loaded."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    total = None
+    packages = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        packages.add(name.strip().split(".")[0])
+        if name.strip() == module:
+            total = int(cumulative)
+    return total, packages
+
+
+def main(args):
+    missed = []
+    print(f"{'entry point':<56} {'import ms':>10}  heavy dependencies")
+    for module in ENTRY_POINTS:
+        runs = [import_time(module) for _ in range(args.repeat)]
+        best = min(total for total, _ in runs)
+        heavy = [name for name in HEAVY if name in runs[0][1]]
+        print(f"{module:<56} {best / 1000:>10.1f}  {', '.join(heavy) or '-'}")
+        if module == "segment_extraction" and (heavy or best / 1000 > args.target_ms):
+            missed.append(module)
+    if missed:
+        print(f"segment_extraction misses its target: under {args.target_ms:.0f} ms without {', '.join(HEAVY)}")
+        sys.exit(1)
+    print(f"segment_extraction meets its target: under {args.target_ms:.0f} ms without {', '.join(HEAVY)}")
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
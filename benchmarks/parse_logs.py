@@ -0,0 +1,86 @@
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import write_binary_log, write_multiclass_log
+from log_parser import parse_log
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--frames", type=int, default=200000, help="Frames per synthetic log")
+parser.add_argument("--repeat", type=int, default=3, help="Timed runs per parser, the best one is reported")
+
+
+def legacy_parse(file_path, multiclass=False):
+    """The dict-per-frame parser the PredictionLog classes used before `log_parser`."""
+    with open(file_path, "r") as f:
+        lines = f.readlines()
+    data = []
+    for idx in range(len(lines)):
+        line = lines[idx]
+        if idx == 0:
+            continue
+        if "|time=" in line:
+            fields = line.split("|")[-1].split(", ")
+            time_range = fields[0].split("=")[1].rstrip()
+            t_start = time_range.split("-")[0]
+            t_end = time_range.split("-")[1]
+            pred = int(fields[1].split("=")[1].rstrip())
+            if multiclass:
+                active_entry = {
+                    "start_t": float(t_start),
+                    "end_t": float(t_end),
+                    "class_id": fields[2].split("=")[1].rstrip(),
+                    "prob": float(fields[3].split("=")[1].rstrip()),
+                    "pred": pred,
+                    "classes": {}
+                }
+                idx += 1
+                line = lines[idx]
+                if "output_layer" in line:
+                    idx += 1
+                    line = lines[idx]
+                while len(line.rstrip()) > 0:
+                    c, p = line.split("=")
+                    active_entry["classes"][c] = float(p.replace(";", "").rstrip())
+                    idx += 1
+                    line = lines[idx]
+            else:
+                active_entry = {
+                    "start_t": float(t_start),
+                    "end_t": float(t_end),
+                    "pred": pred,
+                    "class_id": pred,
+                    "prob": fields[2].split("=")[1].rstrip()
+                }
+            data.append(active_entry)
+    return data
+
+
+def best_of(func, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        logs = {
+            "binary": (write_binary_log(os.path.join(tmp, "binary.log"), "/tmp/N9_S00920_20220516_053000.wav",
+                                        args.frames), False),
+            "multiclass": (write_multiclass_log(os.path.join(tmp, "multiclass.log"),
+                                                "/tmp/target-0ms-500ms_0_N9_S00920_20220516_053000.wav",
+                                                args.frames), True),
+        }
+        for name, (path, multiclass) in logs.items():
+            legacy = best_of(lambda: legacy_parse(path, multiclass), args.repeat)
+            columnar = best_of(lambda: parse_log(path, multiclass), args.repeat)
+            print(f"{name:>10}: {args.frames} frames | dict-per-frame {legacy:.3f}s | "
+                  f"columnar {columnar:.3f}s | speedup {legacy / columnar:.2f}x")
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -0,0 +1,112 @@
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from audio_io import MAX_GAP_S, MAX_WINDOW_S, coalesce
+from segment_extraction import HOP_LENGTH, N_FFT, RecordingSpectrogram, Spectrogram, overlapping_runs, window_spectrograms
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--seconds", type=float, default=600, help="Length of the synthetic recording")
+parser.add_argument("--sr", type=int, default=44100, help="Sample rate of the synthetic recording")
+parser.add_argument("--segment", type=float, default=0.5, help="Length of every segment in seconds")
+parser.add_argument("--hops", type=float, nargs="+", default=[0.25, 1.5],
+                    help="Seconds between segment starts, one layout each. Below --segment the segments overlap")
+parser.add_argument("--repeat", type=int, default=3, help="Timed runs per path, the best one is reported")
+# Largest relative error of the inner frames of a shared transform against a direct transform
+# of the hop-aligned slice, the frames are computed from the same samples.
+TOLERANCE = 1e-4
+
+
+def direct(audio):
+    return Spectrogram(n_fft=N_FFT, hop_length=HOP_LENGTH)(torch.from_numpy(audio).unsqueeze(0))[0]
+
+
+def best_of(func, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+
+def read_windows(audio, ranges, sr):
+    """The ``(window_start, audio, segments)`` read windows segment extraction forms for `ranges`."""
+    starts = np.array([start for start, _ in ranges])
+    stops = np.array([stop for _, stop in ranges])
+    windows = []
+    for window_start, window_stop, indices in coalesce(starts, stops, int(MAX_GAP_S * sr), int(MAX_WINDOW_S * sr)):
+        segments = [(idx, ranges[idx][0], ranges[idx][1]) for idx in indices]
+        windows.append((window_start, audio[window_start:window_stop], segments))
+    return windows
+
+
+def whole_window(windows):
+    """The spectrograms sliced from one transform of every whole read window."""
+    frames = []
+    for window_start, audio, segments in windows:
+        spectrogram = RecordingSpectrogram(audio, window_start)
+        frames.extend(spectrogram.segment(start, stop) for _, start, stop in segments)
+    return frames
+
+
+def check(audio, windows, frames):
+    """Worst relative error of the shared inner frames, asserting what `RecordingSpectrogram.segment` promises.
+
+    Every segment has the frame count of a direct transform. A segment overlapping no other
+    one is its direct transform. The frames of a run of overlapping segments are on the hop
+    grid of the run's first segment, their inner frames match a direct transform of the slice
+    moved onto that grid. Frames whose window reaches past the segment edge see real audio
+    instead of the reflection padding of a direct transform, those are skipped.
+    """
+    edge = N_FFT // (2 * HOP_LENGTH)
+    worst = 0.0
+    frames = iter(frames)
+    for _, _, segments in windows:
+        for run in overlapping_runs(segments):
+            run_start = run[0][1]
+            for _, start, stop in run:
+                power = next(frames)
+                own = direct(audio[start:stop])
+                assert power.shape == own.shape, f"{power.shape} frames instead of {own.shape}"
+                if len(run) == 1:
+                    assert torch.equal(power, own), "a segment overlapping no other one differs from its transform"
+                    continue
+                aligned = run_start + int(round((start - run_start) / HOP_LENGTH)) * HOP_LENGTH
+                reference = direct(audio[aligned:aligned + stop - start])
+                inner = slice(edge, len(reference) - edge)
+                if len(reference[inner]) > 0:
+                    error = (power[inner] - reference[inner]).abs().max() / reference[inner].abs().max()
+                    worst = max(worst, float(error))
+    assert worst <= TOLERANCE, f"inner frames differ by {worst:.2e}"
+    return worst
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    audio = rng.standard_normal(int(args.seconds * args.sr)) * 0.1
+    for hop in args.hops:
+        starts = np.arange(0, args.seconds - args.segment, hop)
+        # Random offsets keep the segment starts off the hop grid.
+        ranges = [(int(s * args.sr) + int(rng.integers(HOP_LENGTH)), int((s + args.segment) * args.sr))
+                  for s in starts.tolist()]
+        windows = read_windows(audio, ranges, args.sr)
+
+        direct_s, _ = best_of(lambda: [direct(audio[start:stop]) for start, stop in ranges], args.repeat)
+        whole_s, _ = best_of(lambda: whole_window(windows), args.repeat)
+        shared_s, frames = best_of(
+            lambda: [power for window_start, window_audio, segments in windows
+                     for power in window_spectrograms(window_start, window_audio, segments)],
+            args.repeat,
+        )
+        worst = check(audio, windows, frames)
+        print(f"{len(ranges)} segments of {args.segment}s every {hop}s over {args.seconds}s | "
+              f"per segment {direct_s:.2f}s | whole window {whole_s:.2f}s ({direct_s / whole_s:.2f}x) | "
+              f"overlapping runs {shared_s:.2f}s ({direct_s / shared_s:.2f}x) | "
+              f"max relative error of inner frames {worst:.2e}")
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -0,0 +1,234 @@
+import argparse
+import contextlib
+import datetime
+import glob
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--data", help="Directory of the synthetic data set, reused if it exists. Default: a temporary directory")
+parser.add_argument("--tables", type=int, default=2, help="Tape-days, each with one ground truth table")
+parser.add_argument("--recordings", type=int, default=3, help="Recordings (binary logs and WAVs) per tape-day")
+parser.add_argument("--seconds", type=float, default=300, help="Length of every recording")
+parser.add_argument("--sr", type=int, default=16000, help="Sample rate of the recordings")
+parser.add_argument("--extractions", type=int, default=100, help="Multiclass logs per recording")
+parser.add_argument("--rows", type=int, default=200, help="Annotations per ground truth table")
+parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage, the fastest one is reported")
+parser.add_argument("--no_memory", dest="memory", action="store_false",
+                    help="Skip the extra run per stage that records the tracemalloc peak")
+parser.add_argument("--spectrograms", action="store_true", help="Render spectrogram images in the segment stage")
+parser.add_argument("--stages", nargs="+", help="Only run these stages")
+parser.add_argument("--output", help="JSON file for the results. Default: benchmark-<date>-<time>.json")
+parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+
+STAGES = [
+    "parse_binary", "parse_multiclass", "group", "make_mapping", "get_ground_truth", "analyze_positives",
+    "analyze_event_detections", "make_tables", "segment",
+]
+
+
+def _quiet(func):
+    """Run `func` with its progress output swallowed."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func()
+
+
+class Suite:
+    """The stages of the benchmark on a synthetic data set in the current directory.
+
+    Every stage is a method returning its counters; `prepare_<stage>` methods build the
+    inputs a stage needs from earlier stages outside of the measured run.
+    """
+
+    def __init__(self, spectrograms=False):
+        import log_cache
+        # The scripts import pandas lazily, load it here so no stage measures the import.
+        import pandas  # noqa: F401
+
+        log_cache.configure(None)
+        self.spectrograms = spectrograms
+        self.binary = sorted(glob.glob("predict_1/*.log"))
+        self.multiclass = sorted(glob.glob("predict_2/*.log"))
+        self.tables = sorted(glob.glob("gt/*.txt"))
+        self._file_map = None
+
+    def file_map(self):
+        from file_map import FileMap
+        from mapping import collect_mapping
+
+        if self._file_map is None:
+            self._file_map = FileMap(mapping=_quiet(lambda: collect_mapping("gt", "predict_1", "predict_2")))
+        return self._file_map
+
+    def parse_binary(self):
+        from log_parser import parse_log
+
+        return {"logs": len(self.binary), "frames": sum(len(parse_log(f)[1]) for f in self.binary)}
+
+    def parse_multiclass(self):
+        from log_parser import parse_log
+
+        return {"logs": len(self.multiclass), "frames": sum(len(parse_log(f, True)[1]) for f in self.multiclass)}
+
+    def prepare_group(self):
+        from log_models import PredictionLog
+
+        self.logs = [PredictionLog(f, use_cache=False) for f in self.binary]
+
+    def group(self):
+        return {"logs": len(self.logs), "events": sum(len(log.group()) for log in self.logs)}
+
+    def make_mapping(self):
+        from mapping import collect_mapping
+
+        mapping = _quiet(lambda: collect_mapping("gt", "predict_1", "predict_2"))
+        return {"tables": len(mapping), "multiclass_logs": sum(len(m) for b in mapping.values() for m in b.values())}
+
+    def prepare_get_ground_truth(self):
+        import registry
+        from log_models import PredictionLog
+
+        f_map = self.file_map()
+        self.lookups = []
+        for gt_file, binary_logs in f_map.gt_pred_map.items():
+            logs = [PredictionLog(m, multiclass=True, lazy=True) for b in binary_logs.values() for m in b]
+            self.lookups.append((registry.get_table(gt_file), logs))
+
+    def get_ground_truth(self):
+        from utilities import get_ground_truths
+
+        matched = 0
+        for table, logs in self.lookups:
+            matched += sum(entry is not None for entry, _, _ in get_ground_truths(table, logs))
+        return {"lookups": sum(len(logs) for _, logs in self.lookups), "matched": matched}
+
+    def prepare_analyze_positives(self):
+        from analyze_binary import count
+
+        os.makedirs("results", exist_ok=True)
+        _quiet(lambda: count("predict_1", self.file_map()))
+
+    def analyze_positives(self):
+        import pandas as pd
+
+        from analyze_binary import analyze_positives
+
+        _quiet(lambda: analyze_positives("results"))
+        return {"overlaps": len(pd.read_csv("results/true_positive_binary_predictions.csv"))}
+
+    def prepare_analyze_event_detections(self):
+        from generate_ground_truth_results import split_predictions
+        from generate_prediction_results import prediction_results
+
+        self.predictions = split_predictions(prediction_results(self.file_map()))
+
+    def analyze_event_detections(self):
+        from generate_ground_truth_results import ground_truth_results
+
+        df = ground_truth_results(self.file_map(), self.predictions)
+        return {"annotations": len(df), "detected": int(df["binary_start"].notna().sum())}
+
+    def make_tables(self):
+        from generate_selection_tables_from_multiclass_predictions import make_tables
+
+        os.makedirs("results/selection_tables", exist_ok=True)
+        _quiet(lambda: make_tables("predict_2", "output.log", "results/selection_tables"))
+        return {"logs": len(self.multiclass), "tables": len(os.listdir("results/selection_tables"))}
+
+    def segment(self):
+        from segment_extraction import extract_segments
+
+        images = "results/spectrograms" if self.spectrograms else None
+        segments = _quiet(lambda: extract_segments(self.binary, "results/segments", images))
+        return {"segments": segments}
+
+
+def measure(suite, stage, repeat, memory):
+    """Best wall time of `repeat` runs, then optionally one more run under tracemalloc."""
+    import registry
+
+    prepare = getattr(suite, f"prepare_{stage}", None)
+    if prepare is not None:
+        prepare()
+    times = []
+    for _ in range(repeat):
+        registry.clear()
+        t0 = time.perf_counter()
+        counters = getattr(suite, stage)()
+        times.append(time.perf_counter() - t0)
+    result = {"seconds": min(times), "runs": times, "counters": counters}
+    if memory:
+        registry.clear()
+        tracemalloc.start()
+        getattr(suite, stage)()
+        result["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+    # ru_maxrss is the peak of the whole process so far, in kilobytes on Linux.
+    result["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def compare(results, previous):
+    print(f"{'stage':<26} {'before s':>9} {'after s':>9} {'speedup':>8}")
+    for stage, result in results["stages"].items():
+        before = previous["stages"].get(stage)
+        if before is None:
+            continue
+        print(f"{stage:<26} {before['seconds']:>9.3f} {result['seconds']:>9.3f} "
+              f"{before['seconds'] / max(result['seconds'], 1e-9):>7.2f}x")
+
+
+def main(args):
+    # The repository root, so `python benchmarks/suite.py` finds the scripts as `python -m benchmarks.suite` does.
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, root)
+    from benchmarks.synthetic import make_dataset
+
+    output = os.path.abspath(args.output or datetime.datetime.now().strftime("benchmark-%Y%m%d-%H%M%S.json"))
+    stages = args.stages or STAGES
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "compare", "data")}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data = os.path.abspath(args.data or tmp)
+        if not os.path.isdir(os.path.join(data, "gt")):
+            t0 = time.perf_counter()
+            make_dataset(data, args.tables, args.recordings, args.seconds, args.extractions, args.rows, args.sr)
+            print(f"Wrote the synthetic data set to {data} in {time.perf_counter() - t0:.1f}s")
+        cwd = os.getcwd()
+        os.chdir(data)
+        try:
+            suite = Suite(args.spectrograms)
+            results = {
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "config": config,
+                "stages": {},
+            }
+            for stage in stages:
+                result = measure(suite, stage, args.repeat, args.memory)
+                results["stages"][stage] = result
+                memory = f" | peak traced {result['peak_traced_mb']:.1f} MB" if "peak_traced_mb" in result else ""
+                counters = ", ".join(f"{k}={v}" for k, v in result["counters"].items())
+                print(f"{stage:<26} {result['seconds']:>8.3f}s{memory} | max RSS {result['max_rss_mb']:.0f} MB | {counters}")
+        finally:
+            os.chdir(cwd)
+
+    with open(output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"Wrote {output}")
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
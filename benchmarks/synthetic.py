@@ -0,0 +1,125 @@
+import os
+
+import numpy as np
+
+LOG_PREFIX = "2022-12-05 10:00:00,000|INFO|"
+
+
+def write_binary_log(path, audio_file, n_frames, frame_len=0.5, hop=0.25, positive_rate=0.1, seed=0):
+    """Write a binary ANIMAL-SPOT prediction log with `n_frames` frames."""
+    rng = np.random.default_rng(seed)
+    probs = rng.random(n_frames)
+    # Positive frames come in short bursts, like real calls do.
+    bursts = rng.random(n_frames) < positive_rate / 3
+    probs[bursts | np.roll(bursts, 1) | np.roll(bursts, 2)] += 1.0
+    probs = np.clip(probs / 1.25, 0, 1)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        f.write(f"{LOG_PREFIX}{audio_file}\n")
+        for i in range(n_frames):
+            start = i * hop
+            p = probs[i]
+            f.write(f"{LOG_PREFIX}time={start:.3f}-{start + frame_len:.3f}, pred={int(p > 0.5)}, prob={p:.4f}\n")
+        f.write(f"{LOG_PREFIX}Prediction finished\n")
+    return path
+
+
+def write_multiclass_log(path, audio_file, n_frames, classes=("female", "male", "noise"), frame_len=0.5, hop=0.25,
+                         seed=0):
+    """Write a multiclass ANIMAL-SPOT prediction log with a class block below every frame."""
+    rng = np.random.default_rng(seed)
+    probs = rng.dirichlet(np.ones(len(classes)), size=n_frames)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        f.write(f"{LOG_PREFIX}{audio_file}\n")
+        for i in range(n_frames):
+            start = i * hop
+            top = int(np.argmax(probs[i]))
+            pred = int(classes[top] != "noise")
+            f.write(f"{LOG_PREFIX}time={start:.3f}-{start + frame_len:.3f}, pred={pred}, "
+                    f"pred_class={classes[top]}, prob={probs[i, top]:.4f}\n")
+            f.write(f"{LOG_PREFIX}output_layer\n")
+            for c, p in zip(classes, probs[i]):
+                f.write(f"{c}={p:.4f};\n")
+            f.write("\n")
+    return path
+
+
+# Columns of a Raven selection table as the annotators export them. The analysis reads
+# Begin/End Time by position, sex/quality/notes/song by name and call_type/likely_sex as
+# the 17th and 18th column.
+TABLE_COLUMNS = [
+    "Selection", "View", "Channel", "Begin Time (s)", "End Time (s)", "Low Freq (Hz)", "High Freq (Hz)",
+    "Delta Time (s)", "Delta Freq (Hz)", "Avg Power Density (dB FS/Hz)", "Begin File", "File Offset (s)",
+    "sex", "quality", "notes", "song", "call_type", "likely_sex",
+]
+
+
+def write_selection_table(path, n_rows, duration, offsets=(0.0,), seed=0):
+    """Write a Raven selection table with `n_rows` annotations in the first `duration` seconds after each of `offsets`."""
+    rng = np.random.default_rng(seed)
+    begin = np.sort(rng.choice(offsets, n_rows) + rng.uniform(0, max(duration - 2.0, 0.0), n_rows))
+    end = begin + rng.uniform(0.2, 1.5, n_rows)
+    low = rng.uniform(1000, 3000, n_rows)
+    high = low + rng.uniform(1000, 5000, n_rows)
+    sexes = rng.choice(["m", "f", "u"], n_rows, p=[0.45, 0.45, 0.1])
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        f.write("\t".join(TABLE_COLUMNS) + "\n")
+        for i in range(n_rows):
+            row = [
+                i + 1, "Spectrogram 1", 1, f"{begin[i]:.6f}", f"{end[i]:.6f}", f"{low[i]:.1f}", f"{high[i]:.1f}",
+                f"{end[i] - begin[i]:.6f}", f"{high[i] - low[i]:.1f}", f"{rng.uniform(-90, -40):.2f}",
+                os.path.basename(path).split(".")[0] + ".wav", f"{begin[i]:.6f}",
+                sexes[i], rng.choice(["A", "B", "C"]), "", rng.choice(["y", "n"]), rng.choice(["call", "song"]),
+                sexes[i],
+            ]
+            f.write("\t".join(str(value) for value in row) + "\n")
+    return path
+
+
+def write_wav(path, seconds, sr=16000, seed=0):
+    """Write a mono PCM_16 WAV of noise with short tonal calls."""
+    import soundfile as sf
+
+    rng = np.random.default_rng(seed)
+    audio = rng.standard_normal(int(seconds * sr)) * 0.05
+    t = np.arange(int(0.3 * sr)) / sr
+    call = 0.3 * np.sin(2 * np.pi * 3000 * t) * np.hanning(len(t))
+    for start in rng.uniform(0, max(seconds - 0.3, 0.0), int(seconds // 5)):
+        first = int(start * sr)
+        audio[first:first + len(call)] += call[:len(audio) - first]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    sf.write(path, audio, sr, subtype="PCM_16")
+    return path
+
+
+def make_dataset(root, tables=2, recordings=3, seconds=300.0, extractions=50, rows=100, sr=16000, seed=0):
+    """Write a complete evaluation tree below `root` and return its directories.
+
+    Every tape-day has a ground truth table (``gt/``) and `recordings` consecutive half hour
+    recordings (``audio/``) with their binary logs (``predict_1/``). The first `extractions`
+    events of every binary log get a multiclass log (``predict_2/``) named after the
+    extracted segment, as segment_extraction names them. Paths inside the logs are relative
+    to `root`.
+    """
+    from log_models import PredictionLog
+
+    directories = {name: os.path.join(root, name) for name in ["gt", "predict_1", "predict_2", "audio"]}
+    frames = int((seconds - 0.5) / 0.25) + 1
+    for t in range(tables):
+        tape_day = f"N{t % 10}_S{920 + t:05d}_202205{16 + t % 14:02d}"
+        write_selection_table(os.path.join(directories["gt"], f"{tape_day}_053000.Table.1.selections.FINAL.txt"),
+                              rows, seconds, offsets=[r * 1800.0 for r in range(recordings)], seed=seed + t)
+        for r in range(recordings):
+            wav = f"{tape_day}_{5 + (30 + r * 30) // 60:02d}{(30 + r * 30) % 60:02d}00.wav"
+            write_wav(os.path.join(directories["audio"], wav), seconds, sr, seed=seed + t * 100 + r)
+            binary_log = os.path.join(directories["predict_1"], wav.replace(".wav", "_predict_output.log"))
+            write_binary_log(binary_log, f"audio/{wav}", frames, seed=seed + t * 100 + r)
+            events = PredictionLog(binary_log, use_cache=False).group()[:extractions]
+            for idx, event in enumerate(events):
+                name = f"target-{int(event['start_t'] * 1000)}ms-{int(event['end_t'] * 1000)}ms_{idx}_{wav}"
+                n_frames = max(int((event["end_t"] - event["start_t"] - 0.5) / 0.25) + 1, 1)
+                write_multiclass_log(os.path.join(directories["predict_2"], name.replace(".wav", "_predict_output.log")),
+                                     f"extractions/{name}", n_frames, seed=seed + idx)
+    return directories
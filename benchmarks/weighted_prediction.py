@@ -0,0 +1,48 @@
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import write_multiclass_log
+from log_models import PredictionLog
+from utilities import get_weighted_predictions
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--logs", type=int, default=2000, help="Multiclass logs (extraction segments) of the tape-day")
+parser.add_argument("--frames", type=int, default=8, help="Frames per multiclass log")
+
+
+def legacy_weighted_prediction(data):
+    """The per-record dict aggregation make_table used before the probability matrix."""
+    preds = {}
+    for p in data:
+        for cl in p["classes"]:
+            if cl not in preds:
+                preds[cl] = 0
+            preds[cl] += p["classes"][cl]
+    sorted_preds = {k: v for k, v in sorted(preds.items(), key=lambda item: item[1])}
+    return list(sorted_preds.keys())[-1]
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        logs = []
+        for i in range(args.logs):
+            name = f"target-{i * 1000}ms-{i * 1000 + 750}ms_{i}_N9_S00920_20220516_053000.wav"
+            path = os.path.join(directory, name.replace(".wav", "_predict_output.log"))
+            write_multiclass_log(path, f"/data/extractions/{name}", args.frames, seed=i)
+            logs.append(PredictionLog(path, multiclass=True, use_cache=False))
+
+    t0 = time.perf_counter()
+    legacy = [legacy_weighted_prediction(log.data) for log in logs]
+    legacy_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    batch = get_weighted_predictions([log.frames for log in logs])
+    batch_s = time.perf_counter() - t0
+    assert batch == legacy, "batch aggregation differs from the per-record loop"
+    print(f"{args.logs} logs of {args.frames} frames | per-record dicts {legacy_s:.3f}s | "
+          f"probability matrix {batch_s:.3f}s | speedup {legacy_s / batch_s:.1f}x")
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
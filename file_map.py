@@ -2,6 +2,35 @@ import json
 
 class FileMap:
     gt_pred_map = None
-    def __init__(self, map_path):
-        with open(map_path, "r") as f:
-            self.gt_pred_map = json.load(f)
\ No newline at end of file
+    def __init__(self, map_path=None, mapping=None):
+        # Either the path of a `file_map.json` or the mapping itself, as `mapping.collect_mapping` returns it.
+        if mapping is None:
+            with open(map_path, "r") as f:
+                mapping = json.load(f)
+        self.gt_pred_map = mapping
+        self.binary_gt_map = {}
+        self.multiclass_binary_map = {}
+        self._build_index()
+
+    def _build_index(self):
+        # Reverse lookups of gt_pred_map. A log listed under several parents keeps the first one,
+        # the same one a scan over gt_pred_map in file order finds.
+        for gt_file, binary_logs in self.gt_pred_map.items():
+            for binary_log, multiclass_logs in binary_logs.items():
+                self.binary_gt_map.setdefault(binary_log, gt_file)
+                for multiclass_log in multiclass_logs:
+                    self.multiclass_binary_map.setdefault(multiclass_log, binary_log)
+
+    def get_gt_file(self, binary_log):
+        """Ground truth table of a binary log, or None if it is not mapped."""
+        return self.binary_gt_map.get(binary_log)
+
+    def get_binary_log(self, multiclass_log):
+        """Binary log a multiclass log was cut from, or None if it is not mapped."""
+        return self.multiclass_binary_map.get(multiclass_log)
+
+    def get_gt_file_from_multiclass(self, multiclass_log):
+        binary_log = self.get_binary_log(multiclass_log)
+        if binary_log is None:
+            return None
+        return self.get_gt_file(binary_log)
@@ -1,115 +1,118 @@
+import argparse
+import numpy as np
 import pandas as pd
-from log_models import SelectionTable, PredictionLog
 from file_map import FileMap
 from collections import namedtuple
-from datetime import timedelta
 import os
-from utilities import get_range_overlap, get_weighted_prediction
+from intervals import first_overlap
+import profiling
+import registry
+
+parser = argparse.ArgumentParser()
+profiling.add_arguments(parser)
 
 Range = namedtuple('Range', ['start', 'end'])
 
 
-def analyze_event_detections(gt_file, prediction_csv, file_map: FileMap):
-    pred_df = pd.read_csv(prediction_csv, parse_dates=['binary_start', 'binary_end'])
-    pred_df = pred_df[pred_df["ground_truth_file"] == os.path.basename(gt_file)]
-
-    table = SelectionTable(gt_file)
-    binary_prediction_logs = file_map.gt_pred_map[gt_file]
-    data = {
-        "ground_truth_file": [],
-        "binary_prediction_file": [],
-        "multiclass_prediction_file": [],
-        "binary_start": [],
-        "binary_end": [],
-        "binary_start_rel": [],
-        "binary_end_rel": [],
-        "ground_truth_start": [],
-        "ground_truth_end": [],
-        "ground_truth_start_rel": [],
-        "ground_truth_end_rel": [],
-        "multiclass_prediction": [],
-        "ground_truth": [],
-        "quality": [],
-        "notes": [],
-        "song": [],
-        "call_type": [],
-        "likely_sex": []
-    }
-    for entry in table.data:
-        entry_start = table.start_date_time + timedelta(seconds=entry["start_t"])
-        entry_end = table.start_date_time + timedelta(seconds=entry["end_t"])
-        r1 = Range(start=entry_start, end=entry_end)
-        data["ground_truth_file"].append(os.path.basename(gt_file))
-        data["ground_truth"].append(entry["class_id"])
-        data["ground_truth_start_rel"].append((r1.start - table.start_date_time).total_seconds())
-        data["ground_truth_end_rel"].append((r1.end - table.start_date_time).total_seconds())
-        data["ground_truth_start"].append(r1.start)
-        data["ground_truth_end"].append(r1.end)
-
-        pred = {
-            "binary_prediction_file": "",
-            "binary_start": "",
-            "binary_end": "",
-            "binary_start_rel": "",
-            "binary_end_rel": "",
-            "multiclass_prediction_file": "",
-            "multiclass_prediction": "",
-            "quality": "",
-            "notes": "",
-            "song": "",
-            "call_type": "",
-            "likely_sex": "",
-        }
-        found = False
-        for idx, row in pred_df.iterrows():
-            r2 = Range(start=row['binary_start'], end=row['binary_end'])
-            overlap = get_range_overlap(r1, r2)
-            if overlap > 0:
-                found = True
-                data["binary_prediction_file"].append(row["binary_prediction_file"])
-                data["binary_start"].append(row["binary_start"])
-                data["binary_end"].append(row["binary_end"])
-                data["binary_start_rel"].append(row["binary_start_rel"])
-                data["binary_end_rel"].append(row["binary_end_rel"])
-                data["multiclass_prediction_file"].append(row["multiclass_prediction_file"])
-                data["multiclass_prediction"].append(row["multiclass_prediction"])
-                data["quality"].append(row["quality"])
-                data["notes"].append(row["notes"])
-                data["song"].append(row["song"])
-                data["call_type"].append(row["call_type"])
-                data["likely_sex"].append(row["likely_sex"])
-                break
-
-        if not found:
-            data["binary_prediction_file"].append(pred["binary_prediction_file"])
-            data["binary_start"].append(pred["binary_start"])
-            data["binary_end"].append(pred["binary_end"])
-            data["binary_start_rel"].append(pred["binary_start_rel"])
-            data["binary_end_rel"].append(pred["binary_end_rel"])
-            data["multiclass_prediction_file"].append(pred["multiclass_prediction_file"])
-            data["multiclass_prediction"].append(pred["multiclass_prediction"])
-            data["quality"].append(pred["quality"])
-            data["notes"].append(pred["notes"])
-            data["song"].append(pred["song"])
-            data["call_type"].append(pred["call_type"])
-            data["likely_sex"].append(pred["likely_sex"])
-
-    return pd.DataFrame(data)
+# Columns copied from the first prediction that overlaps an annotation, empty if none does.
+PREDICTION_COLUMNS = [
+    "binary_prediction_file",
+    "binary_start",
+    "binary_end",
+    "binary_start_rel",
+    "binary_end_rel",
+    "multiclass_prediction_file",
+    "multiclass_prediction",
+    "quality",
+    "notes",
+    "song",
+    "call_type",
+    "likely_sex",
+]
 
+# Prediction times stay datetimes, NaT where no prediction overlaps. to_csv writes NaT as ''.
+TIME_COLUMNS = ["binary_start", "binary_end"]
 
 
+def load_predictions(prediction_csv):
+    """Read `prediction_results.csv` once and split it into the predictions of every ground truth file."""
+    return split_predictions(pd.read_csv(prediction_csv, parse_dates=['binary_start', 'binary_end']))
 
 
-if __name__ == '__main__':
+def split_predictions(pred_df):
+    """The rows of a prediction results frame keyed by their ground truth file name."""
+    return {gt: df for gt, df in pred_df.groupby("ground_truth_file", sort=False)}
+
+
+def analyze_event_detections(gt_file, pred_df, file_map: FileMap):
+    """Pair every annotation of `gt_file` with the first of its predictions (`pred_df`) that overlaps it."""
+    table = registry.get_table(gt_file)
+    if pred_df is None:
+        pred_df = pd.DataFrame(columns=PREDICTION_COLUMNS)
+    binary_start = pd.to_datetime(pred_df["binary_start"]).to_numpy(dtype="datetime64[us]")
+    binary_end = pd.to_datetime(pred_df["binary_end"]).to_numpy(dtype="datetime64[us]")
+    with profiling.stage("overlap"):
+        match = first_overlap(table.begin_time, table.end_time, binary_start, binary_end)
+    found = match >= 0
+
+    # Plain lists, so the column dtypes are inferred the same way as for the rows built one by one.
+    pred = {}
+    for column in PREDICTION_COLUMNS:
+        values = np.full(len(table.data), None if column in TIME_COLUMNS else "", dtype=object)
+        values[found] = pred_df[column].to_numpy(dtype=object)[match[found]]
+        pred[column] = values.tolist()
+    for column in TIME_COLUMNS:
+        pred[column] = pd.to_datetime(pd.Series(pred[column], dtype=object))
+
+    start = np.datetime64(table.start_date_time, "us")
+    with profiling.stage("build_frame"):
+        df = pd.DataFrame({
+            "ground_truth_file": [os.path.basename(gt_file)] * len(table.data),
+            "binary_prediction_file": pred["binary_prediction_file"],
+            "multiclass_prediction_file": pred["multiclass_prediction_file"],
+            "binary_start": pred["binary_start"],
+            "binary_end": pred["binary_end"],
+            "binary_start_rel": pred["binary_start_rel"],
+            "binary_end_rel": pred["binary_end_rel"],
+            "ground_truth_start": table.begin_time.astype(object).tolist(),
+            "ground_truth_end": table.end_time.astype(object).tolist(),
+            "ground_truth_start_rel": ((table.begin_time - start) / np.timedelta64(1, "s")).tolist(),
+            "ground_truth_end_rel": ((table.end_time - start) / np.timedelta64(1, "s")).tolist(),
+            "multiclass_prediction": pred["multiclass_prediction"],
+            "ground_truth": table.data["sex"].tolist(),
+            "quality": pred["quality"],
+            "notes": pred["notes"],
+            "song": pred["song"],
+            "call_type": pred["call_type"],
+            "likely_sex": pred["likely_sex"]
+        })
+    profiling.count("annotation_rows", len(df))
+    return df
+
+
+def ground_truth_results(f_map: FileMap, predictions):
+    """Every annotation of the file map's tables with its first overlapping prediction, see `analyze_event_detections`.
+
+    `predictions` are the prediction results keyed by ground truth file name, as `load_predictions` returns them.
+    """
     dfs = []
-    f_map = FileMap("results/file_map.json")
-    pred_csv = "/home/alex/data/KARAN_ODOM/analysis/results/prediction_results.csv"
     for gt in list(f_map.gt_pred_map.keys()):
-        gt_df = gt_pred_results = pd.DataFrame(analyze_event_detections(gt, pred_csv, f_map))\
-            .sort_values(by=["binary_start"], ascending=True)\
+        with profiling.stage("analyze_event_detections"):
+            detections = analyze_event_detections(gt, predictions.get(os.path.basename(gt)), f_map)
+        gt_df = gt_pred_results = pd.DataFrame(detections)\
+            .sort_values(by=["binary_start"], ascending=True, na_position="last")\
             .reset_index()\
             .drop(columns=["index"])
         dfs.append(gt_df)
+    return pd.concat(dfs, axis=0)
 
-    df = pd.concat(dfs, axis=0)
-    df.to_csv("results/ground_truth_analysis.csv", index=False)
+
+if __name__ == '__main__':
+    ARGS = parser.parse_args()
+    with profiling.session(ARGS):
+        f_map = FileMap("results/file_map.json")
+        pred_csv = "/home/alex/data/KARAN_ODOM/analysis/results/prediction_results.csv"
+        predictions = load_predictions(pred_csv)
+        df = ground_truth_results(f_map, predictions)
+        df.to_csv("results/ground_truth_analysis.csv", index=False)
+    print(registry.summary())
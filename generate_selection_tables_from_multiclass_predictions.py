@@ -1,9 +1,14 @@
 from datetime import datetime, timedelta
-import pandas as pd
 import os
 import glob
+import json
 import argparse
 
+import profiling
+from log_models import PredictionLog
+from parallel import map_files, report_errors
+from utilities import get_weighted_predictions
+
 parser = argparse.ArgumentParser()
 
 parser.add_argument(
@@ -25,181 +30,44 @@ parser.add_argument(
     help="Directory where selection tables will be written"
 )
 
-class PredictionLog:
-    def __init__(self, file_path, non_noise_threshold=0.9, multiclass=False):
-        self.log_file = file_path
-        self.audio_file = ""
-        self.multiclass = multiclass
-        if self.multiclass:
-            self.binary_start = None
-            self.binary_end = None
-        self.gt_start = None
-        self.start_date_time = None
-        self.data = self._init_data()
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes parsing the log files, 0 uses every CPU. Default 1"
+)
 
+parser.add_argument(
+    "--incremental",
+    action="store_true",
+    help="Only parse new or changed log files and only rewrite the selection tables of their tape-days, "
+         "based on the manifest of the previous run in the output directory"
+)
 
+profiling.add_arguments(parser)
 
-    def _get_line_content(self, line):
-        components = line.split("|")
-        return components[-1]
+# Processed logs of every tape-day group, written to the output directory by incremental runs.
+MANIFEST_NAME = "selection_tables_manifest.json"
 
-    def _get_key_value(self, pair):
-        components = pair.split("=")
-        return components[0], components[1].rstrip()
+def get_source(basename):
+    """Recording a multiclass log was extracted from, e.g. ``N9_S00920_20220516_053000``."""
+    return "_".join(basename.split("_")[2:]).replace("_predict_output.log", "")
 
-    def set_start_date(self):
-        basename = os.path.basename(self.audio_file).replace(".wav", "")
-        components = basename.split("_")
-        date_idx = 0
-        time_idx = None
-        while time_idx is None:
-            try:
-                start_date = components[date_idx]
-                datetime.strptime(f"{start_date}", "%Y%m%d")
-                time_idx = date_idx + 1
-            except:
-                date_idx += 1
 
-        start_date = components[date_idx]
-        start_time = components[time_idx]
-        self.start_date_time = datetime.strptime(f"{start_date}T{start_time}", "%Y%m%dT%H%M%S")
-        if self.multiclass:
-            component = components[0]
-            offset_components = component.split("-")
-            self.binary_start = float(offset_components[1].replace("ms", "")) / 1000
-            self.binary_end = float(offset_components[2].replace("ms", "")) / 1000
-
-
-    def _group_smooth(self):
-        grouped = []
-
-        data = [l for l in self.data if l["class_id"] == 1]
-        # data = [l for l in self.data if l["class_id"] != "noise-2" and l["pred"] == 1]
-        group = {
-            "start_t": data[0]["start_t"],
-            "end_t": data[0]["end_t"],
-            "class_id": data[0]["class_id"]
-        }
-        for l in data[1:]:
-            if l["class_id"] == group["class_id"] and l["start_t"] < group["end_t"]:
-                group["end_t"] = l["end_t"]
-            elif l["class_id"] != group["class_id"] and l["start_t"] < group["end_t"]:
-                continue
-            else:
-                grouped.append(group)
-                group = {
-                    "start_t": l["start_t"],
-                    "end_t": l["end_t"],
-                    "class_id": l["class_id"]
-                }
-        return grouped
-
-
-    def _group_non_smooth(self):
-        grouped = []
-
-        start_t = 0.0
-        end_t = 0.0
-        class_id = None
-
-        for idx, line in enumerate(self.data):
-            if class_id is None:
-                class_id = line["class_id"]
-                end_t = line["end_t"]
-                continue
-            if line["class_id"] != class_id:
-                grouped.append({
-                    "start_t": start_t,
-                    "end_t": end_t,
-                    "class_id": class_id
-                })
-                start_t = line["start_t"]
-                end_t = line["end_t"]
-                class_id = line["class_id"]
-                continue
-            if line["class_id"] == class_id:
-                end_t = line["end_t"]
-
-        return grouped
-
-    def group(self, smooth=True):
-        if smooth:
-            return self._group_smooth()
-        return self._group_non_smooth()
-
-    def _init_data(self):
-        with open(self.log_file, "r") as f:
-            lines = f.readlines()
-        data = []
-        for idx in range(len(lines)):
-            line = lines[idx]
-            if idx == 0:
-                self.audio_file = self._get_line_content(line).rstrip()
-                self.set_start_date()
-                continue
-            if "|time=" in line:
-                content = self._get_line_content(line)
-                fields = content.split(", ")
-                time = self._get_key_value(fields[0])
-                t_start = time[1].split("-")[0]
-                t_end = time[1].split("-")[1]
-                pred = int(self._get_key_value(fields[1])[1])
-                if self.multiclass:
-                    pred_class = self._get_key_value(fields[2])[1]
-                    prob = self._get_key_value(fields[3])[1]
-                    active_entry = {
-                        "start_t": float(t_start),
-                        "end_t": float(t_end),
-                        "class_id": pred_class,
-                        "prob": float(prob),
-                        "pred": int(pred),
-                        "classes": {}
-                    }
-                    idx += 1
-                    line = lines[idx]
-                    if "output_layer" in line:
-                        idx += 1
-                        line = lines[idx]
-
-                    while len(line.rstrip()) > 0:
-                        c, p = line.split("=")
-                        p = float(p.replace(";", "").rstrip())
-                        active_entry["classes"][c] = p
-                        idx += 1
-                        line = lines[idx]
-                else:
-                    prob = self._get_key_value(fields[2])[1]
-                    active_entry = {
-                        "start_t": float(t_start),
-                        "end_t": float(t_end),
-                        "pred": int(pred),
-                        "class_id": int(pred),
-                        "prob": prob
-                    }
-                data.append(active_entry)
-        return data
-
-
-def get_weighted_prediction(data):
-    preds = {}
-    for p in data:
-        for cl in p["classes"]:
-            if cl not in preds:
-                preds[cl] = 0
-            preds[cl] += p["classes"][cl]
-    sorted_preds = {k: v for k, v in sorted(preds.items(), key=lambda item: item[1])}
-    top_prediction = list(sorted_preds.keys())[-1]
-    return top_prediction
+def get_tape_day(source):
+    """Tape-day group of a recording, the key `gather_groups` uses."""
+    return "_".join(source.split("_")[0:3])
 
 
 class PredictionLogFile:
-    def __init__(self, file, multiclass=True):
-        print(f"Initializing {file}...")
+    def __init__(self, file, multiclass=True, parse=True):
+        if parse:
+            print(f"Initializing {file}...")
         base = os.path.basename(file)
         components = base.split("_")
         self.file = file
         self.basename = base
-        self.source = "_".join(components[2:]).replace("_predict_output.log", "")
+        self.source = get_source(base)
         self.binary_extraction_start_t = float(components[0].split("-")[1].replace("ms", "")) / 1000
         self.binary_extraction_end_t = float(components[0].split("-")[2].replace("ms", "")) / 1000
         self.binary_extraction_idx = int(components[1])
@@ -223,7 +91,9 @@ class PredictionLogFile:
         self.rel_start_s = None
         self.rel_end_s = None
 
-        self.prediction_log = PredictionLog(self.file, multiclass=multiclass)
+        # Without `parse` only the file name is read, `prediction` is then taken from a manifest.
+        self.prediction_log = PredictionLog(self.file, multiclass=multiclass) if parse else None
+        self.prediction = None
 
 
 def get_files(directory, ext):
@@ -245,8 +115,7 @@ def get_groups(logs):
 def gather_groups(groups):
     gathered_groups = {}
     for key, files in groups.items():
-        components = key.split("_")
-        tape_day = "_".join(components[0:3])
+        tape_day = get_tape_day(key)
         if tape_day not in gathered_groups:
             gathered_groups[tape_day] = []
         gathered_groups[tape_day].append(files)
@@ -262,6 +131,9 @@ def flatten_sort_group(group):
 
 
 def make_table(group, output_directory):
+    # Imported here, an incremental run without changes never builds a table.
+    import pandas as pd
+
     name = group[0].source + "_prediction_selection_table.txt"
     print(f"Writing {name}")
     data = {
@@ -273,26 +145,120 @@ def make_table(group, output_directory):
         "Prediction": [],
     }
     print(f"Found {len(group)} entries")
+    parsed = [entry for entry in group if entry.prediction_log is not None]
+    predictions = get_weighted_predictions([entry.prediction_log.frames for entry in parsed])
+    for entry, prediction in zip(parsed, predictions):
+        entry.prediction = prediction
     for entry in group:
-        prediction = get_weighted_prediction(entry.prediction_log.data)
         data["Begin Time (s)"].append(entry.rel_start_s)
         data["End Time (s)"].append(entry.rel_end_s)
-        data["Prediction"].append(prediction)
+        data["Prediction"].append(entry.prediction)
 
     df = pd.DataFrame(data)
     df.to_csv(os.path.join(output_directory, name), sep="\t", index=False)
+    profiling.count("selection_tables_written")
+    profiling.count("selection_table_rows", len(group))
     print("-----------------------------")
+    return name
 
 
-def make_tables(directory, ext, output_directory):
-    logs = [PredictionLogFile(l) for l in get_files(directory, ext)]
+def make_tables(directory, ext, output_directory, workers=1, incremental=False):
+    if incremental:
+        return update_tables(directory, ext, output_directory, workers)
+    with profiling.stage("read_logs"):
+        logs = report_errors(map_files(PredictionLogFile, get_files(directory, ext), workers))
     print(f"Found {len(logs)} multiclass log files")
     groups = get_groups(logs)
     for key, value in groups.items():
-        make_table(value, output_directory)
+        with profiling.stage("make_table"):
+            make_table(value, output_directory)
+
+
+def _fingerprint(file):
+    stat = os.stat(file)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_manifest(output_directory):
+    path = os.path.join(output_directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, output_directory):
+    path = os.path.join(output_directory, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def update_tables(directory, ext, output_directory, workers=1):
+    """Incremental `make_tables`: re-parse only new or changed logs, rewrite only the tables of their tape-days.
+
+    The manifest in `output_directory` records the table name and, per log, size, mtime and
+    weighted prediction of every tape-day group. A group is rebuilt when one of its logs is
+    new, changed or gone, or when its table file is missing; its unchanged logs are placed
+    from their file name and the prediction in the manifest. Returns the rewritten table names.
+    """
+    manifest = load_manifest(output_directory)
+    known = {path: entry for group in manifest.values() for path, entry in group["logs"].items()}
+    files = [os.path.abspath(f) for f in get_files(directory, ext)]
+    fingerprints = {f: _fingerprint(f) for f in files}
+    changed = {f for f in files if {k: known.get(f, {}).get(k) for k in ("size", "mtime_ns")} != fingerprints[f]}
+
+    tape_days = {}
+    for f in files:
+        tape_days.setdefault(get_tape_day(get_source(os.path.basename(f))), []).append(f)
+    stale = [
+        key for key, group_files in tape_days.items()
+        if key not in manifest
+        or set(group_files) != set(manifest[key]["logs"])
+        or any(f in changed for f in group_files)
+        or not os.path.exists(os.path.join(output_directory, manifest[key]["table"]))
+    ]
+    print(f"Found {len(files)} multiclass log files, {len(changed)} new or changed, "
+          f"{len(stale)} of {len(tape_days)} tape-days to update")
+
+    stale_files = [f for key in stale for f in tape_days[key]]
+    with profiling.stage("read_logs"):
+        logs = report_errors(map_files(PredictionLogFile, [f for f in stale_files if f in changed], workers))
+    for f in stale_files:
+        if f not in changed:
+            log = PredictionLogFile(f, parse=False)
+            log.prediction = known[f]["prediction"]
+            logs.append(log)
+
+    written = []
+    groups = get_groups(logs) if logs else {}
+    for key, group in groups.items():
+        with profiling.stage("make_table"):
+            name = make_table(group, output_directory)
+        previous = manifest.get(key)
+        if previous is not None and previous["table"] != name:
+            _remove(os.path.join(output_directory, previous["table"]))
+        manifest[key] = {
+            "table": name,
+            "logs": {entry.file: dict(fingerprints[entry.file], prediction=entry.prediction) for entry in group},
+        }
+        written.append(name)
+    # Tape-days without any log left, or whose logs all failed to parse.
+    removed = [key for key in manifest if key not in tape_days or (key in stale and key not in groups)]
+    for key in removed:
+        _remove(os.path.join(output_directory, manifest.pop(key)["table"]))
+    if stale or removed:
+        save_manifest(manifest, output_directory)
+    print(f"Rewrote {len(written)} of {len(tape_days)} selection tables")
+    return written
+
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
 
-ARGS = parser.parse_args()
 if __name__ == '__main__':
+    ARGS = parser.parse_args()
     # extension = "output.log"
     # folder = "/home/alex/data/KARAN_ODOM/predict_2_EvalSet_20221205/logs"
     # output_dir = "/home/alex/data/KARAN_ODOM/predict_2_EvalSet_20221205"
@@ -300,4 +266,5 @@ if __name__ == '__main__':
     output_dir = ARGS.output_dir
     print(f"Looking for files in {input_dir}")
     print(f"Writing selection tables to {output_dir}")
-    make_tables(ARGS.input_dir, ARGS.log_extension, ARGS.output_dir)
+    with profiling.session(ARGS):
+        make_tables(ARGS.input_dir, ARGS.log_extension, ARGS.output_dir, ARGS.workers, ARGS.incremental)
@@ -0,0 +1,119 @@
+from collections import namedtuple
+
+import numpy as np
+
+# Grouped events of a prediction log as parallel arrays, one entry per event.
+Segments = namedtuple("Segments", ["start_t", "end_t", "class_id"])
+
+
+def _runs(start_t, end_t, code, overlapping):
+    """First and last index of every run of consecutive frames with the same class code.
+
+    With `overlapping` a run also ends where a frame does not overlap the frame before it.
+    """
+    new_run = np.empty(len(code), dtype=bool)
+    new_run[0] = True
+    new_run[1:] = code[1:] != code[:-1]
+    if overlapping:
+        new_run[1:] |= start_t[1:] >= end_t[:-1]
+    first = np.flatnonzero(new_run)
+    last = np.append(first[1:] - 1, len(code) - 1)
+    return first, last
+
+
+def _concat(closed):
+    if len(closed) == 0:
+        return Segments(np.empty(0), np.empty(0), np.empty(0, dtype=np.int64))
+    return Segments(*(np.concatenate(column) for column in zip(*closed)))
+
+
+def smooth_segments(chunks):
+    """Group the positive frames of a log into events, chunk by chunk.
+
+    `chunks` yields ``(start_t, end_t, code)`` arrays of the positive frames only, with
+    an integer class code per frame. A frame extends the open event if it has the same
+    class and starts before the event ends. A frame of another class that starts before
+    the event ends is skipped. Any other frame closes the event and opens a new one.
+    The event that is still open at the end of the log is not returned.
+    """
+    closed = []
+    state = None
+    for start_t, end_t, code in chunks:
+        if len(code) == 0:
+            continue
+        first, last = _runs(start_t, end_t, code, overlapping=True)
+        run_start = start_t[first]
+        run_end = end_t[last]
+        run_code = code[first]
+
+        if np.all(run_code == run_code[0]) and (state is None or state[2] == run_code[0]):
+            # With a single class every run boundary is an event boundary, only the first
+            # run of the chunk may continue the event left open by the previous chunk.
+            if state is not None and run_start[0] < state[1]:
+                run_start[0] = state[0]
+            elif state is not None:
+                closed.append(([state[0]], [state[1]], [state[2]]))
+            closed.append((run_start[:-1], run_end[:-1], run_code[:-1]))
+            state = [run_start[-1], run_end[-1], run_code[-1]]
+            continue
+
+        events = ([], [], [])
+        for f, l, c in zip(first.tolist(), last.tolist(), run_code.tolist()):
+            if state is None:
+                state = [start_t[f], end_t[l], c]
+            elif c == state[2]:
+                if start_t[f] < state[1]:
+                    state[1] = end_t[l]
+                    continue
+                for column, value in zip(events, state):
+                    column.append(value)
+                state = [start_t[f], end_t[l], c]
+            else:
+                after = np.flatnonzero(start_t[f:l + 1] >= state[1])
+                if len(after) == 0:
+                    continue
+                for column, value in zip(events, state):
+                    column.append(value)
+                state = [start_t[f + after[0]], end_t[l], c]
+        closed.append(tuple(np.asarray(column, dtype=dtype) for column, dtype
+                            in zip(events, [np.float64, np.float64, code.dtype])))
+    return _concat(closed)
+
+
+def non_smooth_segments(chunks):
+    """Group all frames of a log into runs of the same class, chunk by chunk.
+
+    `chunks` yields ``(start_t, end_t, code)`` arrays of every frame. The first event
+    starts at 0 and the run that is still open at the end of the log is not returned.
+    """
+    closed = []
+    state = None
+    for start_t, end_t, code in chunks:
+        if len(code) == 0:
+            continue
+        first, last = _runs(start_t, end_t, code, overlapping=False)
+        run_start = start_t[first]
+        run_end = end_t[last]
+        run_code = code[first]
+        if state is None:
+            run_start[0] = 0.0
+        elif state[2] == run_code[0]:
+            run_start[0] = state[0]
+        else:
+            closed.append(([state[0]], [state[1]], [state[2]]))
+        closed.append((run_start[:-1], run_end[:-1], run_code[:-1]))
+        state = [run_start[-1], run_end[-1], run_code[-1]]
+    return _concat(closed)
+
+
+def segment_records(segments):
+    """The events as the list of ``{"start_t", "end_t", "class_id"}`` dicts `group()` returns."""
+    return [
+        {
+            "start_t": start_t,
+            "end_t": end_t,
+            "class_id": class_id
+        }
+        for start_t, end_t, class_id
+        in zip(segments.start_t.tolist(), segments.end_t.tolist(), segments.class_id.tolist())
+    ]
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+def ranges(lo, hi):
+    """Concatenated indices of the ranges [lo, hi) and the offset of every range in them."""
+    lengths = hi - lo
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    flat = np.arange(lengths.sum()) - np.repeat(offsets - lo, lengths)
+    return flat, offsets
+
+
+class SortedIntervals:
+    """Closed intervals sorted by start, for repeated overlap lookups.
+
+    Intervals overlap if ``max(starts) <= min(ends)``, the same test
+    `utilities.get_range_overlap` applies. Works on any sortable dtype (floats, datetime64).
+    Sorting happens once, every lookup is a binary search over the sorted starts and the
+    running maximum of the ends, so it is near linear in the number of queries plus the
+    number of pairs found as long as the intervals are not nested deeply into each other.
+    """
+
+    def __init__(self, start, end):
+        start, end = np.asarray(start), np.asarray(end)
+        self.order = np.argsort(start, kind="stable")
+        self.start = start[self.order]
+        self.end = end[self.order]
+        self._max_end = np.maximum.accumulate(self.end) if len(self.end) else self.end
+
+    def __len__(self):
+        return len(self.start)
+
+    def pairs(self, start, end):
+        """Index pairs ``(i, j)`` of every query ``i`` that overlaps interval ``j``, sorted by ``i`` and then ``j``.
+
+        ``j`` indexes the intervals in the order they were passed in, so the pairs come out
+        in the order of a nested loop over the queries and the intervals.
+        """
+        start, end = np.asarray(start), np.asarray(end)
+        if len(start) == 0 or len(self) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        # Every interval before `lo` ends before the query starts, none from `hi` on starts before it ends.
+        lo = np.searchsorted(self._max_end, start, side="left")
+        hi = np.maximum(np.searchsorted(self.start, end, side="right"), lo)
+        flat, _ = ranges(lo, hi)
+        i = np.repeat(np.arange(len(start)), hi - lo)
+        keep = self.end[flat] >= start[i]
+        i = i[keep]
+        j = self.order[flat[keep]]
+        pairs = np.lexsort((j, i))
+        return i[pairs], j[pairs]
+
+    def first(self, start, end):
+        """For every query the lowest index of an overlapping interval, -1 if there is none."""
+        i, j = self.pairs(start, end)
+        first = np.full(len(start), -1, dtype=np.int64)
+        is_first = np.ones(len(i), dtype=bool)
+        is_first[1:] = i[1:] != i[:-1]
+        first[i[is_first]] = j[is_first]
+        return first
+
+
+def overlap_pairs(a_start, a_end, b_start, b_end):
+    """Index pairs ``(i, j)`` of every interval ``a[i]`` that overlaps an interval ``b[j]``, see `SortedIntervals.pairs`."""
+    return SortedIntervals(b_start, b_end).pairs(a_start, a_end)
+
+
+def first_overlap(a_start, a_end, b_start, b_end):
+    """For every ``a`` interval the lowest index of an overlapping ``b`` interval, -1 if there is none."""
+    return SortedIntervals(b_start, b_end).first(a_start, a_end)
@@ -0,0 +1,177 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import profiling
+from log_parser import LogFrames
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument(
+    "--cache_dir",
+    dest="cache_dir",
+    help="Cache directory. Defaults to $ASPOT_LOG_CACHE",
+)
+
+parser.add_argument(
+    "--clear",
+    dest="clear",
+    action="store_true",
+    help="Remove every cached log",
+)
+
+parser.add_argument(
+    "--invalidate",
+    dest="invalidate",
+    nargs="+",
+    default=[],
+    help="Remove the cached entries of these log files",
+)
+
+# The cache is off unless a directory is configured, either here or through $ASPOT_LOG_CACHE.
+CACHE_DIR = os.environ.get("ASPOT_LOG_CACHE") or None
+MAX_BYTES = int(float(os.environ.get("ASPOT_LOG_CACHE_MAX_MB", 2048)) * 1024 * 1024)
+
+_ARRAYS = ["start_t", "end_t", "pred", "prob", "label", "class_probs"]
+
+# Size of the cache as of the last directory walk plus what this process stored since, None
+# before the first walk. Entries other processes store only count from the next walk on,
+# which `evict` does whenever the running total exceeds the budget.
+_total_bytes = None
+
+
+def configure(directory=None, max_bytes=None):
+    global CACHE_DIR, MAX_BYTES, _total_bytes
+    CACHE_DIR = directory
+    _total_bytes = None
+    if max_bytes is not None:
+        MAX_BYTES = max_bytes
+
+
+def _entry_path(log_file, variant):
+    key = hashlib.sha1(f"{os.path.abspath(log_file)}\0{variant}".encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, f"{key}.npz")
+
+
+def _fingerprint(log_file):
+    stat = os.stat(log_file)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def load(log_file, variant):
+    """Return the cached ``(header, frames)`` of a log, or None if there is no valid entry.
+
+    An entry is only valid while the log keeps the size and mtime it had when it was cached.
+    """
+    if CACHE_DIR is None:
+        return None
+    entry = _entry_path(log_file, variant)
+    try:
+        with np.load(entry, allow_pickle=False) as cached:
+            if not np.array_equal(cached["fingerprint"], _fingerprint(log_file)):
+                profiling.count("log_cache_misses")
+                return None
+            header = json.loads(str(cached["header"]))
+            frames = LogFrames(
+                labels=cached["labels"].tolist(),
+                class_names=cached["class_names"].tolist(),
+                **{name: cached[name] for name in _ARRAYS}
+            )
+        # Loading counts as a use, eviction removes the least recently used entries first.
+        os.utime(entry)
+    except (OSError, KeyError, ValueError):
+        profiling.count("log_cache_misses")
+        return None
+    profiling.count("log_cache_hits")
+    return header, frames
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def store(log_file, variant, header, frames):
+    """Cache the parsed frames of a log together with its header fields."""
+    global _total_bytes
+    if CACHE_DIR is None:
+        return
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    if _total_bytes is None:
+        _total_bytes = sum(_size(e) for e in glob.glob(os.path.join(CACHE_DIR, "*.npz")))
+    entry = _entry_path(log_file, variant)
+    replaced = _size(entry)
+    tmp = f"{entry}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(
+            f,
+            fingerprint=_fingerprint(log_file),
+            header=np.array(json.dumps(header)),
+            labels=np.array(frames.labels, dtype=str),
+            class_names=np.array(frames.class_names, dtype=str),
+            **{name: getattr(frames, name) for name in _ARRAYS}
+        )
+    os.replace(tmp, entry)
+    _total_bytes += _size(entry) - replaced
+    if _total_bytes > MAX_BYTES:
+        evict(MAX_BYTES)
+
+
+def evict(max_bytes):
+    """Remove the least recently used entries until the cache fits into `max_bytes`."""
+    global _total_bytes
+    if CACHE_DIR is None:
+        return
+    entries = []
+    for entry in glob.glob(os.path.join(CACHE_DIR, "*.npz")):
+        try:
+            stat = os.stat(entry)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, entry))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(entry)
+        except OSError:
+            pass
+        total -= size
+    _total_bytes = total
+
+
+def invalidate(log_file):
+    global _total_bytes
+    if CACHE_DIR is None:
+        return
+    for variant in ["binary", "multiclass"]:
+        entry = _entry_path(log_file, variant)
+        if os.path.exists(entry):
+            if _total_bytes is not None:
+                _total_bytes -= _size(entry)
+            os.remove(entry)
+
+
+def clear():
+    evict(0)
+
+
+if __name__ == '__main__':
+    ARGS = parser.parse_args()
+    if ARGS.cache_dir is not None:
+        configure(ARGS.cache_dir)
+    if CACHE_DIR is None:
+        parser.error("no cache directory, pass --cache_dir or set $ASPOT_LOG_CACHE")
+    if ARGS.clear:
+        clear()
+    for log in ARGS.invalidate:
+        invalidate(log)
+    entries = glob.glob(os.path.join(CACHE_DIR, "*.npz"))
+    print(f"{len(entries)} cached logs, {sum(os.path.getsize(e) for e in entries) / 1024 / 1024:.1f} MB in {CACHE_DIR}")
@@ -2,11 +2,16 @@ import numpy as np
 import os
 import datetime
 
-import pandas as pd
+import log_cache
+import profiling
+from intervals import SortedIntervals
+from utilities import seconds_to_timedelta64
+from grouping import non_smooth_segments, segment_records, smooth_segments
+from log_parser import CHUNK_SIZE, iter_chunks, parse_log, read_header
 
 
 class PredictionLog:
-    def __init__(self, file_path, non_noise_threshold=0.9, multiclass=False):
+    def __init__(self, file_path, non_noise_threshold=0.9, multiclass=False, stream=False, use_cache=True, lazy=False):
         self.log_file = file_path
         self.audio_file = ""
         self.multiclass = multiclass
@@ -15,17 +20,48 @@ class PredictionLog:
             self.binary_end = None
         self.gt_start = None
         self.start_date_time = None
-        self.data = self._init_data()
-
-
-
-    def _get_line_content(self, line):
-        components = line.split("|")
-        return components[-1]
-
-    def _get_key_value(self, pair):
-        components = pair.split("=")
-        return components[0], components[1].rstrip()
+        self.use_cache = use_cache
+        self.stream = stream
+        self._frames = None
+        self._data = None
+        if stream or lazy:
+            self.audio_file = read_header(self.log_file)
+            self.set_start_date()
+        else:
+            self._frames = self._init_data()
+
+    @property
+    def frames(self):
+        # Lazy logs only read their header line up front and parse the frames on first access.
+        if self._frames is None and not self.stream:
+            self._frames = self._init_data()
+        return self._frames
+
+    @property
+    def data(self):
+        if self._data is None:
+            if self.frames is None:
+                raise ValueError(f"{self.log_file} was opened with stream=True, iterate iter_data() instead")
+            self._data = self._records(self.frames)
+        return self._data
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        frames = self.frames
+        if frames is None:
+            cached = log_cache.load(self.log_file, self._cache_variant()) if self.use_cache else None
+            if cached is None:
+                yield from iter_chunks(self.log_file, self.multiclass, chunk_size)
+                return
+            frames = cached[1]
+        for start in range(0, len(frames), chunk_size):
+            yield frames.slice(start, start + chunk_size)
+
+    def iter_data(self, chunk_size=CHUNK_SIZE):
+        if self._data is not None:
+            yield from self._data
+            return
+        for chunk in self.iter_chunks(chunk_size):
+            yield from self._records(chunk)
 
     def set_start_date(self):
         basename = os.path.basename(self.audio_file).replace(".wav", "")
@@ -50,114 +86,109 @@ class PredictionLog:
             self.binary_end = float(offset_components[2].replace("ms", "")) / 1000
 
 
-    def _group_smooth(self):
-        grouped = []
-
-        data = [l for l in self.data if l["class_id"] == 1]
-        # data = [l for l in self.data if l["class_id"] != "noise-2" and l["pred"] == 1]
-        group = {
-            "start_t": data[0]["start_t"],
-            "end_t": data[0]["end_t"],
-            "class_id": data[0]["class_id"]
-        }
-        for l in data[1:]:
-            if l["class_id"] == group["class_id"] and l["start_t"] < group["end_t"]:
-                group["end_t"] = l["end_t"]
-            elif l["class_id"] != group["class_id"] and l["start_t"] < group["end_t"]:
-                continue
-            else:
-                grouped.append(group)
-                group = {
-                    "start_t": l["start_t"],
-                    "end_t": l["end_t"],
-                    "class_id": l["class_id"]
-                }
-        return grouped
+    def _grouping_input(self, frames, smooth):
+        code = frames.label if self.multiclass else frames.pred
+        if not smooth:
+            return frames.start_t, frames.end_t, code
+        # The class_id of a multiclass frame is its class name, which never equals 1.
+        positive = code == 1 if not self.multiclass else np.zeros(len(code), dtype=bool)
+        return frames.start_t[positive], frames.end_t[positive], code[positive]
+
+    def segments(self, smooth=True, chunks=None):
+        """The grouped events of the log as `Segments` arrays.
+
+        `chunks` are the `LogFrames` chunks to group, by default the log is read again
+        through `iter_chunks`. Pass them to group the chunks of a pass that also does
+        something else with them.
+        """
+        labels = []
+        if chunks is None:
+            chunks = self.iter_chunks()
+
+        def grouping_input():
+            for frames in chunks:
+                labels[:] = frames.labels
+                yield self._grouping_input(frames, smooth)
+
+        with profiling.stage("group"):
+            segments = smooth_segments(grouping_input()) if smooth else non_smooth_segments(grouping_input())
+        if self.multiclass:
+            segments = segments._replace(class_id=np.asarray(labels, dtype=object)[segments.class_id])
+        return segments
 
+    def _group_smooth(self):
+        return segment_records(self.segments(smooth=True))
 
     def _group_non_smooth(self):
-        grouped = []
-
-        start_t = 0.0
-        end_t = 0.0
-        class_id = None
-
-        for idx, line in enumerate(self.data):
-            if class_id is None:
-                class_id = line["class_id"]
-                end_t = line["end_t"]
-                continue
-            if line["class_id"] != class_id:
-                grouped.append({
-                    "start_t": start_t,
-                    "end_t": end_t,
-                    "class_id": class_id
-                })
-                start_t = line["start_t"]
-                end_t = line["end_t"]
-                class_id = line["class_id"]
-                continue
-            if line["class_id"] == class_id:
-                end_t = line["end_t"]
-
-        return grouped
+        return segment_records(self.segments(smooth=False))
 
     def group(self, smooth=True):
         if smooth:
             return self._group_smooth()
         return self._group_non_smooth()
 
+    def _cache_variant(self):
+        return "multiclass" if self.multiclass else "binary"
+
+    def _get_header(self):
+        header = {
+            "audio_file": self.audio_file,
+            "start_date_time": self.start_date_time.isoformat()
+        }
+        if self.multiclass:
+            header["binary_start"] = self.binary_start
+            header["binary_end"] = self.binary_end
+        return header
+
+    def _set_header(self, header):
+        self.audio_file = header["audio_file"]
+        if "start_date_time" not in header:
+            self.set_start_date()
+            return
+        self.start_date_time = datetime.datetime.fromisoformat(header["start_date_time"])
+        if self.multiclass:
+            self.binary_start = header["binary_start"]
+            self.binary_end = header["binary_end"]
+
     def _init_data(self):
-        with open(self.log_file, "r") as f:
-            lines = f.readlines()
-        data = []
-        for idx in range(len(lines)):
-            line = lines[idx]
-            if idx == 0:
-                self.audio_file = self._get_line_content(line).rstrip()
-                self.set_start_date()
-                continue
-            if "|time=" in line:
-                content = self._get_line_content(line)
-                fields = content.split(", ")
-                time = self._get_key_value(fields[0])
-                t_start = time[1].split("-")[0]
-                t_end = time[1].split("-")[1]
-                pred = int(self._get_key_value(fields[1])[1])
-                if self.multiclass:
-                    pred_class = self._get_key_value(fields[2])[1]
-                    prob = self._get_key_value(fields[3])[1]
-                    active_entry = {
-                        "start_t": float(t_start),
-                        "end_t": float(t_end),
-                        "class_id": pred_class,
-                        "prob": float(prob),
-                        "pred": int(pred),
-                        "classes": {}
-                    }
-                    idx += 1
-                    line = lines[idx]
-                    if "output_layer" in line:
-                        idx += 1
-                        line = lines[idx]
-
-                    while len(line.rstrip()) > 0:
-                        c, p = line.split("=")
-                        p = float(p.replace(";", "").rstrip())
-                        active_entry["classes"][c] = p
-                        idx += 1
-                        line = lines[idx]
-                else:
-                    prob = self._get_key_value(fields[2])[1]
-                    active_entry = {
-                        "start_t": float(t_start),
-                        "end_t": float(t_end),
-                        "pred": int(pred),
-                        "class_id": int(pred),
-                        "prob": prob
-                    }
-                data.append(active_entry)
-        return data
+        if self.use_cache:
+            cached = log_cache.load(self.log_file, self._cache_variant())
+            if cached is not None:
+                header, frames = cached
+                self._set_header(header)
+                return frames
+        with profiling.stage("parse_logs"):
+            self.audio_file, frames = parse_log(self.log_file, self.multiclass)
+        self.set_start_date()
+        if self.use_cache:
+            log_cache.store(self.log_file, self._cache_variant(), self._get_header(), frames)
+        return frames
+
+    def _records(self, frames):
+        columns = zip(frames.start_t.tolist(), frames.end_t.tolist(), frames.pred.tolist(), frames.prob.tolist())
+        if self.multiclass:
+            return [
+                {
+                    "start_t": start_t,
+                    "end_t": end_t,
+                    "class_id": class_id,
+                    "prob": prob,
+                    "pred": pred,
+                    "classes": classes
+                }
+                for (start_t, end_t, pred, prob), class_id, classes
+                in zip(columns, frames.label_names().tolist(), frames.class_dicts())
+            ]
+        return [
+            {
+                "start_t": start_t,
+                "end_t": end_t,
+                "pred": pred,
+                "class_id": pred,
+                "prob": prob
+            }
+            for start_t, end_t, pred, prob in columns
+        ]
 
 
 class SelectionTable:
@@ -165,7 +196,8 @@ class SelectionTable:
         self.file_path = file_path
         self.start_date_time = self.set_start_date_time()
         self.data = self._init_data()
-
+        self.begin_time, self.end_time = self._absolute_times()
+        self.intervals = SortedIntervals(self.begin_time, self.end_time)
 
     def set_start_date_time(self):
         basename = os.path.basename(self.file_path).replace(".Table.1.selections.FINAL.txt", "")
@@ -183,9 +215,24 @@ class SelectionTable:
         return datetime.datetime.strptime(s, "%Y%m%dT%H%M%S")
 
     def _init_data(self):
-        data = pd.read_csv(self.file_path, sep="\t")
+        # pandas is only needed for selection tables, scripts that just read logs skip its import.
+        import pandas as pd
+
+        with profiling.stage("read_tables"):
+            data = pd.read_csv(self.file_path, sep="\t")
+        profiling.count("table_rows", len(data))
         return data
 
+    def _absolute_times(self):
+        """Begin and end time of every annotation as absolute datetime64 values, in row order."""
+        start = np.datetime64(self.start_date_time, "us")
+        offsets = seconds_to_timedelta64(self.data.iloc[:, [3, 4]].to_numpy(dtype=np.float64))
+        return start + offsets[:, 0], start + offsets[:, 1]
+
+    def find_overlaps(self, start, end):
+        """Row of the first annotation overlapping each of the `start`/`end` datetime ranges, -1 where none does."""
+        return self.intervals.first(np.asarray(start, dtype="datetime64[us]"), np.asarray(end, dtype="datetime64[us]"))
+
 
 if __name__ == '__main__':
     f = "/media/alex/s1/experiments/ANIMAL-SPOT/warbler/trained_multi_class_model/WARBLER_SEG_AS_MULTI_3CLASS_V4/predictions/2019_22MAY18C12GWAC12GW1T2_predict_output.log"
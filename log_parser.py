@@ -0,0 +1,322 @@
+import os
+from itertools import compress, islice
+
+import numpy as np
+
+import profiling
+
+# Lines read per chunk when a log is streamed instead of parsed in one piece, a chunk has at
+# most as many frames.
+CHUNK_SIZE = 65536
+
+
+class LogFrames:
+    """Columnar frames of an ANIMAL-SPOT prediction log.
+
+    Every per-frame field is a NumPy array with one entry per ``|time=`` line.
+    ``label`` indexes into ``labels`` (the predicted class of a multiclass frame,
+    ``-1`` for binary logs) and ``class_probs`` is a frames x ``len(class_names)``
+    matrix holding the per-class probabilities listed below each multiclass frame.
+    Classes missing from a frame's block are ``NaN``.
+    """
+
+    def __init__(self, start_t, end_t, pred, prob, label=None, labels=None, class_probs=None, class_names=None):
+        self.start_t = start_t
+        self.end_t = end_t
+        self.pred = pred
+        self.prob = prob
+        n = len(start_t)
+        self.label = label if label is not None else np.full(n, -1, dtype=np.int32)
+        self.labels = labels if labels is not None else []
+        self.class_probs = class_probs if class_probs is not None else np.empty((n, 0), dtype=np.float64)
+        self.class_names = class_names if class_names is not None else []
+
+    def __len__(self):
+        return len(self.start_t)
+
+    def slice(self, start, stop):
+        return LogFrames(
+            start_t=self.start_t[start:stop],
+            end_t=self.end_t[start:stop],
+            pred=self.pred[start:stop],
+            prob=self.prob[start:stop],
+            label=self.label[start:stop],
+            labels=self.labels,
+            class_probs=self.class_probs[start:stop],
+            class_names=self.class_names,
+        )
+
+    def label_names(self):
+        """Predicted class of every frame as an object array of strings."""
+        return np.asarray(self.labels + [None], dtype=object)[self.label]
+
+    def class_dicts(self):
+        """Per-frame ``{class: probability}`` dicts, matching the legacy ``classes`` entry."""
+        names = self.class_names
+        dicts = []
+        for row in self.class_probs.tolist():
+            dicts.append({names[i]: p for i, p in enumerate(row) if p == p})
+        return dicts
+
+
+def _get_line_content(line):
+    return line.split("|")[-1]
+
+
+def _get_value(pair):
+    return pair.partition("=")[2]
+
+
+def read_header(file_path):
+    """Return the audio file named on the first line of a prediction log."""
+    with open(file_path, "r") as f:
+        return _get_line_content(f.readline()).rstrip()
+
+
+class _ChunkBuilder:
+    def __init__(self, labels, class_names, multiclass):
+        self.labels = labels
+        self.class_names = class_names
+        self.multiclass = multiclass
+        self.starts = []
+        self.ends = []
+        self.preds = []
+        self.probs = []
+        self.label = []
+        self.class_rows = []
+        self.class_cols = []
+        self.class_values = []
+
+    def build(self):
+        n = len(self.starts)
+        frames = LogFrames(
+            start_t=np.array(self.starts, dtype=np.float64),
+            end_t=np.array(self.ends, dtype=np.float64),
+            pred=np.array(self.preds, dtype=np.float64).astype(np.int64),
+            prob=np.array(self.probs, dtype=np.float64),
+        )
+        if self.multiclass:
+            class_probs = np.full((n, len(self.class_names)), np.nan, dtype=np.float64)
+            class_probs[self.class_rows, self.class_cols] = np.array(self.class_values, dtype=np.float64)
+            frames.label = np.array(self.label, dtype=np.int32)
+            frames.labels = list(self.labels)
+            frames.class_probs = class_probs
+            frames.class_names = list(self.class_names)
+        return frames
+
+
+def _parse_by_line(lines, multiclass, labels, class_names):
+    """Parse a block of complete frames line by line, the fallback of `_parse_block`."""
+    chunk = _ChunkBuilder(labels, class_names, multiclass)
+    lines = iter(lines)
+    for line in lines:
+        if "|time=" not in line:
+            continue
+        fields = line.rpartition("|")[2].split(", ")
+        t_start, t_end = _get_value(fields[0]).split("-")[0:2]
+        chunk.starts.append(t_start)
+        chunk.ends.append(t_end)
+        chunk.preds.append(_get_value(fields[1]))
+        if not multiclass:
+            chunk.probs.append(_get_value(fields[2]))
+        else:
+            chunk.label.append(labels.setdefault(_get_value(fields[2]).rstrip(), len(labels)))
+            chunk.probs.append(_get_value(fields[3]))
+
+            row = len(chunk.starts) - 1
+            line = next(lines, "")
+            if "output_layer" in line:
+                line = next(lines, "")
+            while len(line.rstrip()) > 0:
+                c, p = line.split("=")
+                chunk.class_rows.append(row)
+                chunk.class_cols.append(class_names.setdefault(c, len(class_names)))
+                chunk.class_values.append(p.replace(";", ""))
+                line = next(lines, "")
+    return chunk.build()
+
+
+def _numbers(text, count):
+    """The comma separated numbers in `text` as a float array, None unless there are exactly `count`."""
+    try:
+        numbers = np.fromstring(text, sep=",")
+    except ValueError:
+        return None
+    return numbers if len(numbers) == count else None
+
+
+def _parse_block(lines, multiclass, labels, class_names):
+    """Parse a block of complete frames in bulk.
+
+    The frame lines are joined into one text that NumPy converts at once, after the field
+    names are replaced by separators; only the predicted classes and the class names are
+    cut out as strings. Class lines are the lines without a ``|`` that are not blank and
+    belong to the frame before them. Returns None if a line does not have the layout
+    ANIMAL-SPOT writes, without touching `labels` or `class_names`.
+    """
+    is_frame = ["|time=" in line for line in lines]
+    # The first "-" of a frame line separates its start and end time, later ones belong to numbers.
+    contents = [line.rpartition("|")[2].replace("-", ",", 1) for line in compress(lines, is_frame)]
+    n = len(contents)
+    text = "".join(contents).replace("time=", "").replace(", pred=", ",")
+    if multiclass:
+        # Every frame splits into its start,end,pred and prob numbers around its class.
+        parts = text.replace(", prob=", ", pred_class=").split(", pred_class=")
+        if len(parts) != 2 * n + 1:
+            return None
+        frame_labels = parts[1::2]
+        text = ",".join(parts[0::2])
+    else:
+        text = text.replace(", prob=", ",")
+    numbers = _numbers(text.replace("\n", ","), 4 * n)
+    if numbers is None:
+        return None
+    numbers = numbers.reshape(n, 4)
+    frames = LogFrames(
+        start_t=numbers[:, 0].copy(),
+        end_t=numbers[:, 1].copy(),
+        pred=numbers[:, 2].astype(np.int64),
+        prob=numbers[:, 3].copy(),
+    )
+    if not multiclass:
+        return frames
+
+    rows = np.cumsum(np.array(is_frame, dtype=bool)) - 1
+    is_class = (rows >= 0) & ~np.array(["|" in line or line.isspace() for line in lines], dtype=bool)
+    rows = rows[is_class]
+    class_lines = list(compress(lines, is_class.tolist()))
+    pairs = "".join(class_lines)
+    if pairs and not pairs.endswith("\n"):
+        pairs += "\n"
+    pairs = pairs.replace(";", "").replace("\n", "=").split("=")
+    if len(pairs) != 2 * len(class_lines) + 1:
+        return None
+    values = _numbers(",".join(pairs[1:-1:2]), len(class_lines))
+    if values is None:
+        return None
+
+    frame_labels = list(map(str.rstrip, frame_labels))
+    for label in dict.fromkeys(frame_labels):
+        labels.setdefault(label, len(labels))
+    names = pairs[0:-1:2]
+    for name in dict.fromkeys(names):
+        class_names.setdefault(name, len(class_names))
+    frames.label = np.fromiter(map(labels.__getitem__, frame_labels), dtype=np.int32, count=n)
+    frames.labels = list(labels)
+    frames.class_probs = np.full((n, len(class_names)), np.nan, dtype=np.float64)
+    cols = np.fromiter(map(class_names.__getitem__, names), dtype=np.intp, count=len(names))
+    frames.class_probs[rows, cols] = values
+    frames.class_names = list(class_names)
+    return frames
+
+
+def _parse(lines, multiclass, labels, class_names):
+    frames = _parse_block(lines, multiclass, labels, class_names)
+    if frames is None:
+        frames = _parse_by_line(lines, multiclass, labels, class_names)
+    profiling.count("log_frames", len(frames))
+    return frames
+
+
+def _count_lines(lines):
+    n = 0
+    try:
+        for line in lines:
+            n += 1
+            yield line
+    finally:
+        profiling.count("log_lines", n)
+
+
+def iter_frame_chunks(lines, multiclass=False, chunk_size=CHUNK_SIZE):
+    """Parse the frame lines of a prediction log (everything after the header) while reading them.
+
+    Reads `chunk_size` lines at a time and yields a `LogFrames` of at most `chunk_size`
+    frames for each, so only one chunk is held in memory at a time. A multiclass frame
+    whose class lines are cut off by the end of a read moves to the next chunk, a frame
+    longer than `chunk_size` lines is read to its end. The class vocabularies are shared
+    by all chunks of a log, so ``label`` and the ``class_probs`` columns mean the same
+    thing in every chunk; a later chunk can only be wider than an earlier one. With
+    `chunk_size` None the whole log is returned as one chunk.
+    """
+    labels = {}
+    class_names = {}
+    lines = iter(_count_lines(lines) if profiling.ENABLED else lines)
+    if chunk_size is None:
+        yield _parse(list(lines), multiclass, labels, class_names)
+        return
+
+    carry = []
+    while True:
+        block = carry + list(islice(lines, max(chunk_size - len(carry), 1)))
+        if len(block) < chunk_size:
+            if block:
+                frames = _parse(block, multiclass, labels, class_names)
+                if len(frames) > 0:
+                    yield frames
+            return
+        carry = []
+        if multiclass:
+            # The last frame of the block may miss class lines that are still to be read.
+            last = len(block) - 1
+            while last > 0 and "|time=" not in block[last]:
+                last -= 1
+            if last > 0:
+                carry = block[last:]
+                del block[last:]
+            else:
+                # A single frame longer than the block, read on to the start of the next one.
+                for line in lines:
+                    if "|time=" in line:
+                        carry = [line]
+                        break
+                    block.append(line)
+        frames = _parse(block, multiclass, labels, class_names)
+        if len(frames) > 0:
+            yield frames
+
+
+def concat_frames(chunks):
+    """Join consecutive chunks of one log back into a single `LogFrames`."""
+    chunks = list(chunks)
+    last = chunks[-1]
+    width = len(last.class_names)
+    class_probs = []
+    for chunk in chunks:
+        padding = np.full((len(chunk), width - chunk.class_probs.shape[1]), np.nan)
+        class_probs.append(np.hstack([chunk.class_probs, padding]))
+    return LogFrames(
+        start_t=np.concatenate([c.start_t for c in chunks]),
+        end_t=np.concatenate([c.end_t for c in chunks]),
+        pred=np.concatenate([c.pred for c in chunks]),
+        prob=np.concatenate([c.prob for c in chunks]),
+        label=np.concatenate([c.label for c in chunks]),
+        labels=last.labels,
+        class_probs=np.vstack(class_probs),
+        class_names=last.class_names,
+    )
+
+
+def parse_lines(lines, multiclass=False):
+    """Parse the frame lines of a prediction log (everything after the header) in one pass."""
+    return next(iter_frame_chunks(lines, multiclass, chunk_size=None))
+
+
+def parse_log(file_path, multiclass=False):
+    """Read a prediction log in a single pass.
+
+    Returns the audio file from the header line and the frames as a `LogFrames`.
+    """
+    with open(file_path, "r") as f:
+        audio_file = _get_line_content(f.readline()).rstrip()
+        frames = parse_lines(f, multiclass)
+        profiling.count("log_bytes_read", os.fstat(f.fileno()).st_size)
+    return audio_file, frames
+
+
+def iter_chunks(file_path, multiclass=False, chunk_size=CHUNK_SIZE):
+    """Stream the frames of a prediction log as `LogFrames` chunks of at most `chunk_size` frames."""
+    with open(file_path, "r") as f:
+        f.readline()
+        yield from iter_frame_chunks(f, multiclass, chunk_size)
+        profiling.count("log_bytes_read", os.fstat(f.fileno()).st_size)
@@ -1,61 +1,139 @@
+import argparse
 import glob
 import json
 import os
-from log_models import PredictionLog
+import profiling
+import registry
+from parallel import map_files, report_errors
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument(
+    "--ground_truth",
+    default="/home/alex/data/KARAN_ODOM/FINAL corrected annotations",
+    help="Directory with the ground truth selection tables",
+)
+
+parser.add_argument(
+    "--binary",
+    default="/home/alex/data/KARAN_ODOM/predict_1",
+    help="Directory with the binary prediction logs",
+)
+
+parser.add_argument(
+    "--multiclass",
+    default="/home/alex/data/KARAN_ODOM/predict_2_EvalSet_20221205",
+    help="Directory with the multiclass prediction logs",
+)
+
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes reading the multiclass log headers, 0 uses every CPU. Default 1",
+)
+
+profiling.add_arguments(parser)
 
 def get_files(directory, ext):
     return glob.glob(f"{directory}/**/*.{ext}", recursive=True)
 
-def get_multiclass_for_binary(multiclass_prediction_logs, bin_file):
-    leading = get_leading_component(bin_file, 4)
+def get_multiclass_for_binary(multiclass_index, bin_file):
     wav_file = os.path.basename(bin_file).replace("_predict_output.log", ".wav")
-    logs = [m for m in multiclass_prediction_logs if wav_file in m.audio_file]
-    files = [m.log_file for m in logs]
-
-    return files
+    return list(multiclass_index.get(wav_file, []))
 
 def get_leading_component(file, count=3):
     base_file = os.path.basename(file.replace(".Table.1.selections.FINAL.txt", ""))
     leading_component = "_".join(base_file.split("_")[0:count])
     return leading_component
 
-def make_mapping(gt_folder, p1_folder, p2_folder):
-    data = {}
+def index_binary_files(binary_files, count=3):
+    """Key every binary log by each run of `count` consecutive components of its file name.
 
-    ground_truth_files = get_files(gt_folder, "txt")
-    binary_files = get_files(p1_folder, "log")
-    multiclass_files = get_files(p2_folder, "log")
-    multiclass_prediction_logs = [PredictionLog(m) for m in multiclass_files]
+    A ground truth table then finds its binary logs with one lookup of its leading component.
+    """
+    index = {}
+    for f in binary_files:
+        components = os.path.basename(f).split("_")
+        keys = {"_".join(components[i:i + count]) for i in range(max(len(components) - count + 1, 1))}
+        for key in keys:
+            index.setdefault(key, []).append(f)
+    return index
+
+def index_multiclass_logs(multiclass_prediction_logs, wav_files=None):
+    """Key the multiclass logs by every `_`-separated suffix of their source audio file name.
+
+    The multiclass logs of an extraction are named `<extraction>_<binary source wav>`, so
+    the source wav of a binary log is one of those suffixes. If `wav_files` is given, only
+    those suffixes are kept.
+    """
+    index = {}
+    for m in multiclass_prediction_logs:
+        name = os.path.basename(m.audio_file)
+        start = 0
+        while True:
+            suffix = name[start:]
+            if wav_files is None or suffix in wav_files:
+                index.setdefault(suffix, []).append(m.log_file)
+            start = name.find("_", start) + 1
+            if start == 0:
+                break
+    return index
+
+def build_mapping(ground_truth_files, binary_files, multiclass_prediction_logs):
+    data = {}
+    binary_index = index_binary_files(binary_files)
+    wav_files = {os.path.basename(b).replace("_predict_output.log", ".wav") for b in binary_files}
+    multiclass_index = index_multiclass_logs(multiclass_prediction_logs, wav_files)
     total_logs = 0
     bin_logs = 0
-    bin_lo = []
+    bin_lo = set()
 
     for gt in ground_truth_files:
         leading_component = get_leading_component(gt)
 
         data[gt] = {}
 
-        binary_predictions = [f for f in binary_files if leading_component in f]
+        binary_predictions = binary_index.get(leading_component, [])
         bin_logs += len(binary_predictions)
-        bin_lo += binary_predictions
+        bin_lo.update(binary_predictions)
         for b in binary_predictions:
-            m = get_multiclass_for_binary(multiclass_prediction_logs, b)
+            m = get_multiclass_for_binary(multiclass_index, b)
             total_logs += len(m)
             data[gt][b] = m
+    return data, bin_lo, bin_logs, total_logs
+
+def read_multiclass_header(log_file):
+    return registry.get_log(log_file, lazy=True)
+
+def collect_mapping(gt_folder, p1_folder, p2_folder, workers=1):
+    """The file map of the three directories as the dict `make_mapping` writes to `file_map.json`."""
+    ground_truth_files = get_files(gt_folder, "txt")
+    binary_files = get_files(p1_folder, "log")
+    multiclass_files = get_files(p2_folder, "log")
+    with profiling.stage("read_headers"):
+        multiclass_prediction_logs = report_errors(map_files(read_multiclass_header, multiclass_files, workers))
+    with profiling.stage("build_mapping"):
+        data, bin_lo, bin_logs, total_logs = build_mapping(ground_truth_files, binary_files, multiclass_prediction_logs)
+    profiling.count("ground_truth_tables", len(ground_truth_files))
+    profiling.count("binary_logs", len(binary_files))
+    profiling.count("multiclass_logs", len(multiclass_files))
 
-    with open("results/file_map.json", "w") as f:
-        json.dump(data, f, indent=4)
     for f in binary_files:
         if f not in bin_lo:
             print(f)
     print(f"Binary Logs: {bin_logs}")
     print(f"Multiclass Logs: {total_logs}")
+    return data
+
+def make_mapping(gt_folder, p1_folder, p2_folder, workers=1):
+    data = collect_mapping(gt_folder, p1_folder, p2_folder, workers)
+    with open("results/file_map.json", "w") as f:
+        json.dump(data, f, indent=4)
 
 
 
 if __name__ == '__main__':
-    ground_truth = "/home/alex/data/KARAN_ODOM/FINAL corrected annotations"
-    binary = "/home/alex/data/KARAN_ODOM/predict_1"
-    multiclass = "/home/alex/data/KARAN_ODOM/predict_2_EvalSet_20221205"
-
-    make_mapping(ground_truth, binary, multiclass)
+    ARGS = parser.parse_args()
+    with profiling.session(ARGS):
+        make_mapping(ARGS.ground_truth, ARGS.binary, ARGS.multiclass, ARGS.workers)
@@ -0,0 +1,108 @@
+import os
+import queue
+import threading
+import traceback
+from collections import namedtuple
+from functools import partial
+
+# Outcome of running a task on one file. Exactly one of `value` and `error` is set.
+FileResult = namedtuple("FileResult", ["path", "value", "error"])
+
+
+def _run(func, args, path):
+    try:
+        return FileResult(path=path, value=func(path, *args), error=None)
+    except Exception:
+        return FileResult(path=path, value=None, error=traceback.format_exc())
+
+
+def resolve_workers(workers):
+    """`workers` < 1 means one worker per CPU."""
+    if workers is None or workers < 1:
+        return os.cpu_count() or 1
+    return workers
+
+
+def iter_files(func, paths, workers=1, chunksize=None, args=()):
+    """Run ``func(path, *args)`` for every path and yield a `FileResult` per path, in input order.
+
+    With more than one worker the paths are handed to a process pool in chunks of
+    `chunksize` paths (by default about four chunks per worker), so `func` and `args`
+    have to be picklable. An exception raised for one file is captured in its result
+    instead of stopping the run.
+    """
+    paths = list(paths)
+    workers = min(resolve_workers(workers), max(len(paths), 1))
+    task = partial(_run, func, args)
+    if workers == 1:
+        for path in paths:
+            yield task(path)
+        return
+    # The process pool machinery is only imported when there is more than one worker.
+    from concurrent.futures import ProcessPoolExecutor
+
+    if chunksize is None:
+        chunksize = max(1, len(paths) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(task, paths, chunksize=chunksize)
+
+
+def map_files(func, paths, workers=1, chunksize=None, args=()):
+    """Like `iter_files` but returns the list of results."""
+    return list(iter_files(func, paths, workers, chunksize, args))
+
+
+def report_errors(results):
+    """Print the captured error of every failed file and return the values of the others."""
+    values = []
+    for result in results:
+        if result.error is not None:
+            print(f"Failed to process {result.path}:\n{result.error}")
+            continue
+        values.append(result.value)
+    return values
+
+
+class BackgroundWriter:
+    """Writes files on a background thread, fed through a bounded queue.
+
+    `put` blocks while `maxsize` files are waiting, so producers cannot run ahead of the disk
+    by more than that. Call `close` to wait for the pending files; the first error raised
+    while writing is re-raised there.
+    """
+
+    def __init__(self, maxsize=64):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._error = None
+        self.files = 0
+        self.bytes = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            path, data = item
+            if self._error is not None:
+                continue
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(data)
+                self.files += 1
+                self.bytes += len(data)
+            except Exception as e:
+                self._error = e
+
+    def put(self, path, data):
+        if self._error is not None:
+            raise self._error
+        self._queue.put((path, data))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,249 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+
+import profiling
+import registry
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument(
+    "--ground_truth",
+    required=True,
+    help="Directory with the ground truth selection tables",
+)
+
+parser.add_argument(
+    "--binary",
+    required=True,
+    help="Directory with the binary prediction logs",
+)
+
+parser.add_argument(
+    "--multiclass",
+    required=True,
+    help="Directory with the multiclass prediction logs",
+)
+
+parser.add_argument(
+    "--sunrise",
+    help="Excel file with the sunrise time of every annotation file. Without it no predictions are filtered by sunrise",
+)
+
+parser.add_argument(
+    "--output_dir",
+    default="results",
+    help="Where the prediction selection tables (and the requested intermediate files) are written. Default `results`",
+)
+
+parser.add_argument(
+    "--write",
+    nargs="+",
+    default=[],
+    choices=["file_map", "prediction_results", "ground_truth_results", "past_sunrise_prediction_results"],
+    help="Intermediate results to write to --output_dir, under the names the single scripts use",
+)
+
+parser.add_argument(
+    "--cache_dir",
+    help="Keep the stage results here and skip stages whose inputs did not change since the last run",
+)
+
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes reading the multiclass log headers, 0 uses every CPU. Default 1",
+)
+
+profiling.add_arguments(parser)
+
+
+def _file_fingerprints(directory):
+    """Path, size and mtime of every file below `directory`, in a stable order."""
+    entries = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            entries.append([path, stat.st_size, stat.st_mtime_ns])
+    return sorted(entries)
+
+
+class Stage:
+    """One step of a `Pipeline`: `run` gets the results of the `inputs` stages as arguments.
+
+    `params` and the files below `directories` (or single `files`) make up the inputs a
+    stage reads from outside the pipeline, they decide together with the inputs'
+    fingerprints whether a cached result is still valid. `check` can reject a cached
+    result anyway, e.g. when the files a stage wrote are gone.
+    """
+
+    def __init__(self, name, run, inputs=(), params=None, directories=(), files=(), check=None):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.params = params
+        self.directories = list(directories)
+        self.files = list(files)
+        self.check = check
+
+    def fingerprint(self, input_fingerprints):
+        sources = [_file_fingerprints(d) for d in self.directories]
+        sources += [[f, os.stat(f).st_size, os.stat(f).st_mtime_ns] for f in self.files]
+        state = json.dumps([self.name, self.params, input_fingerprints, sources], default=str)
+        return hashlib.sha1(state.encode("utf-8")).hexdigest()
+
+
+class Pipeline:
+    """Runs stages in dependency order and hands their results over in memory.
+
+    With a `cache_dir` every result is pickled next to the fingerprint of its inputs, and a
+    stage whose fingerprint did not change is loaded instead of run again.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.stages = {}
+        self.results = {}
+        self.fingerprints = {}
+        self.skipped = []
+
+    def add(self, stage):
+        self.stages[stage.name] = stage
+        return stage
+
+    def order(self, targets):
+        """The stages needed for `targets`, every stage after its inputs."""
+        ordered = []
+
+        def visit(name, path):
+            if name in path:
+                raise ValueError(f"Cycle in the pipeline: {' -> '.join(path + [name])}")
+            if name in ordered:
+                return
+            for dependency in self.stages[name].inputs:
+                visit(dependency, path + [name])
+            ordered.append(name)
+
+        for target in targets:
+            visit(target, [])
+        return ordered
+
+    def _cache_path(self, name):
+        return os.path.join(self.cache_dir, f"{name}.pkl")
+
+    def _load(self, name, fingerprint):
+        if self.cache_dir is None or not os.path.exists(self._cache_path(name)):
+            return False, None
+        with open(self._cache_path(name), "rb") as f:
+            cached_fingerprint, result = pickle.load(f)
+        return cached_fingerprint == fingerprint, result
+
+    def _store(self, name, fingerprint, result):
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._cache_path(name)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump((fingerprint, result), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    def run(self, targets):
+        """Run the stages `targets` depend on and return the results of all of them by name."""
+        for name in self.order(targets):
+            stage = self.stages[name]
+            fingerprint = stage.fingerprint([self.fingerprints[i] for i in stage.inputs])
+            self.fingerprints[name] = fingerprint
+            valid, result = self._load(name, fingerprint)
+            if valid and (stage.check is None or stage.check(result)):
+                print(f"[{name}] inputs unchanged, using the cached result")
+                self.skipped.append(name)
+            else:
+                print(f"[{name}] running")
+                with profiling.stage(name):
+                    result = stage.run(*[self.results[i] for i in stage.inputs])
+                self._store(name, fingerprint, result)
+            self.results[name] = result
+        return self.results
+
+
+def evaluation_pipeline(gt_folder, p1_folder, p2_folder, sunrise=None, output_dir="results", cache_dir=None,
+                        workers=1):
+    """The evaluation scripts as one `Pipeline`.
+
+    make_mapping -> generate_prediction_results -> generate_ground_truth_results and
+    analyze_predictions -> generate_selection_tables, with the file map, prediction results
+    and past sunrise results passed on in memory instead of through their files.
+    """
+    # Imported here, so the runner itself starts without pandas.
+    from analyze_predictions import analyze_frame
+    from file_map import FileMap
+    from generate_ground_truth_results import ground_truth_results, split_predictions
+    from generate_prediction_results import prediction_results
+    from generate_selection_tables import convert_to_selection_table
+    from mapping import collect_mapping
+
+    def selection_tables(past_sunrise):
+        os.makedirs(output_dir, exist_ok=True)
+        convert_to_selection_table(past_sunrise, output_dir)
+        return [os.path.join(output_dir, gt.replace('.txt', 'predictions.txt'))
+                for gt in past_sunrise["ground_truth_file"].unique()]
+
+    def past_sunrise(predictions):
+        # filter_by_sunrise adds a column, keep the prediction results as they are.
+        return analyze_frame(predictions.copy(), sunrise) if sunrise is not None else predictions
+
+    pipeline = Pipeline(cache_dir)
+    pipeline.add(Stage("file_map", lambda: collect_mapping(gt_folder, p1_folder, p2_folder, workers),
+                       directories=[gt_folder, p1_folder, p2_folder]))
+    pipeline.add(Stage("prediction_results", lambda mapping: prediction_results(FileMap(mapping=mapping)),
+                       inputs=["file_map"]))
+    pipeline.add(Stage("ground_truth_results",
+                       lambda mapping, predictions: ground_truth_results(FileMap(mapping=mapping),
+                                                                         split_predictions(predictions)),
+                       inputs=["file_map", "prediction_results"]))
+    pipeline.add(Stage("past_sunrise_prediction_results", past_sunrise, inputs=["prediction_results"],
+                       files=[sunrise] if sunrise is not None else []))
+    pipeline.add(Stage("selection_tables", selection_tables, inputs=["past_sunrise_prediction_results"],
+                       params=os.path.abspath(output_dir), check=lambda paths: all(map(os.path.exists, paths))))
+    return pipeline
+
+
+# File names the single scripts write their results to.
+INTERMEDIATE_FILES = {
+    "file_map": "file_map.json",
+    "prediction_results": "prediction_results.csv",
+    "ground_truth_results": "ground_truth_analysis.csv",
+    "past_sunrise_prediction_results": "past_sunrise_prediction_results.csv",
+}
+
+
+def write_intermediates(results, names, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    for name in names:
+        path = os.path.join(output_dir, INTERMEDIATE_FILES[name])
+        if name == "file_map":
+            with open(path, "w") as f:
+                json.dump(results[name], f, indent=4)
+        else:
+            results[name].to_csv(path, index=False)
+        print(f"Wrote {path}")
+
+
+def run(gt_folder, p1_folder, p2_folder, sunrise=None, output_dir="results", write=(), cache_dir=None, workers=1):
+    pipeline = evaluation_pipeline(gt_folder, p1_folder, p2_folder, sunrise, output_dir, cache_dir, workers)
+    # ground_truth_results feeds no other stage, it only runs when it is written.
+    results = pipeline.run(["selection_tables"] + list(write))
+    write_intermediates(results, write, output_dir)
+    print(registry.summary())
+    return results
+
+
+if __name__ == '__main__':
+    ARGS = parser.parse_args()
+    with profiling.session(ARGS):
+        run(ARGS.ground_truth, ARGS.binary, ARGS.multiclass, ARGS.sunrise, ARGS.output_dir, ARGS.write, ARGS.cache_dir,
+            ARGS.workers)
@@ -0,0 +1,159 @@
+import contextlib
+import cProfile
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+# Profiling is off unless a script is run with --profile, see `session`. While it is off
+# `stage` hands out one shared no-op context and `count` returns after a single check.
+ENABLED = False
+# Directory of the per stage cProfile files, None for no cProfile.
+STATS_DIR = None
+# Peak traced memory per stage, slows the profiled run down noticeably.
+MEMORY = False
+
+counters = Counter()
+stages = {}
+
+_NULL = contextlib.nullcontext()
+_stack = []
+_profiles = {}
+_started = None
+
+
+def add_arguments(parser):
+    """Add the --profile options to the argument parser of a script."""
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="profile.json",
+        help="Record the wall time of every stage and counters of the work done and write them as JSON "
+             "to this file. Default `profile.json`",
+    )
+    parser.add_argument(
+        "--profile_memory",
+        action="store_true",
+        help="With --profile also record the peak traced memory (tracemalloc) of every stage",
+    )
+    parser.add_argument(
+        "--profile_stats",
+        help="With --profile also write the cProfile statistics of every stage to <stage>.prof in this directory",
+    )
+
+
+def configure(enabled=True, stats_dir=None, memory=False):
+    global ENABLED, STATS_DIR, MEMORY, _started
+    ENABLED = enabled
+    STATS_DIR = stats_dir
+    MEMORY = memory
+    counters.clear()
+    stages.clear()
+    _profiles.clear()
+    _started = time.perf_counter() if enabled else None
+
+
+def count(name, n=1):
+    if ENABLED:
+        counters[name] += n
+
+
+def _max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+class _Stage:
+    def __init__(self, name):
+        self.name = name
+        self.child_peak = 0
+
+    def __enter__(self):
+        parent = _stack[-1] if _stack else None
+        if parent is not None and STATS_DIR is not None:
+            _profiles[parent.name].disable()
+        if MEMORY:
+            if parent is not None:
+                parent.child_peak = max(parent.child_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        _stack.append(self)
+        if STATS_DIR is not None:
+            _profiles.setdefault(self.name, cProfile.Profile()).enable()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        if STATS_DIR is not None:
+            _profiles[self.name].disable()
+        _stack.pop()
+        parent = _stack[-1] if _stack else None
+        stage = stages.setdefault(self.name, {"calls": 0, "seconds": 0.0})
+        stage["calls"] += 1
+        stage["seconds"] += elapsed
+        stage["max_rss_mb"] = _max_rss_mb()
+        if MEMORY:
+            peak = max(self.child_peak, tracemalloc.get_traced_memory()[1])
+            stage["peak_traced_mb"] = max(stage.get("peak_traced_mb", 0.0), peak / 1024 / 1024)
+            if parent is not None:
+                parent.child_peak = max(parent.child_peak, peak)
+            tracemalloc.reset_peak()
+        if parent is not None and STATS_DIR is not None:
+            _profiles[parent.name].enable()
+        return False
+
+
+def stage(name):
+    """Context that adds the wall time of its block to stage `name`.
+
+    Stages may nest, the time of a nested stage counts for its parent as well, its cProfile
+    statistics go to its own file only. Only the current process is measured, work done by
+    worker processes shows up in the wall time of the stage waiting for it.
+    """
+    if not ENABLED:
+        return _NULL
+    return _Stage(name)
+
+
+def report():
+    """The recorded stages and counters as a JSON serializable dict."""
+    return {
+        "command": sys.argv,
+        "seconds": time.perf_counter() - _started if _started is not None else None,
+        "max_rss_mb": _max_rss_mb(),
+        "stages": stages,
+        "counters": dict(counters),
+    }
+
+
+def write_report(path):
+    if STATS_DIR is not None:
+        os.makedirs(STATS_DIR, exist_ok=True)
+        for name, profile in _profiles.items():
+            profile.dump_stats(os.path.join(STATS_DIR, f"{name}.prof"))
+    with open(path, "w") as f:
+        json.dump(report(), f, indent=4)
+    print(f"Wrote the profile to {path}")
+
+
+@contextlib.contextmanager
+def session(args):
+    """Profile the block if the script was run with --profile and write the report at its end."""
+    if getattr(args, "profile", None) is None:
+        yield
+        return
+    configure(True, args.profile_stats, args.profile_memory)
+    if MEMORY:
+        tracemalloc.start()
+    try:
+        with stage("total"):
+            yield
+    finally:
+        if MEMORY:
+            tracemalloc.stop()
+        write_report(args.profile)
+        configure(False)
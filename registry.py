@@ -0,0 +1,111 @@
+import os
+from collections import OrderedDict
+
+import profiling
+from log_models import PredictionLog, SelectionTable
+
+# Memory budget of the registry, set through $ASPOT_REGISTRY_MAX_MB or configure().
+MAX_BYTES = int(float(os.environ.get("ASPOT_REGISTRY_MAX_MB", 1024)) * 1024 * 1024)
+
+# Rough size of one materialized `PredictionLog.data` record (a dict of floats and strings).
+_RECORD_BYTES = 400
+
+# key -> (fingerprint, artifact, size), the size is measured when the artifact is added and,
+# for logs, again on every hit.
+_entries = OrderedDict()
+_total_bytes = 0
+stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def configure(max_bytes=None):
+    global MAX_BYTES
+    if max_bytes is not None:
+        MAX_BYTES = max_bytes
+    evict(MAX_BYTES)
+
+
+def _fingerprint(file_path):
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _size(artifact, fingerprint):
+    if isinstance(artifact, SelectionTable):
+        return int(artifact.data.memory_usage(deep=True).sum()) + artifact.begin_time.nbytes * 4
+    if artifact.stream:
+        # Streamed logs keep only their header, the frames are read again on every pass.
+        return 0
+    frames = artifact._frames
+    if frames is None:
+        # A lazy log parses its frames on first access, estimate them with the size of the file.
+        return fingerprint[0]
+    size = sum(getattr(frames, name).nbytes for name in ["start_t", "end_t", "pred", "prob", "label", "class_probs"])
+    if artifact._data is not None:
+        size += len(artifact._data) * _RECORD_BYTES
+    return size
+
+
+def _get(key, file_path, load):
+    global _total_bytes
+    fingerprint = _fingerprint(file_path)
+    entry = _entries.get(key)
+    if entry is not None and entry[0] == fingerprint:
+        _entries.move_to_end(key)
+        stats["hits"] += 1
+        profiling.count("registry_hits")
+        if isinstance(entry[1], PredictionLog):
+            # Logs grow when their frames or records are materialized after they were added.
+            size = _size(entry[1], fingerprint)
+            _entries[key] = (fingerprint, entry[1], size)
+            _total_bytes += size - entry[2]
+            evict(MAX_BYTES)
+        return entry[1]
+    stats["misses"] += 1
+    profiling.count("registry_misses")
+    artifact = load()
+    if entry is not None:
+        _total_bytes -= entry[2]
+    size = _size(artifact, fingerprint)
+    _entries[key] = (fingerprint, artifact, size)
+    _entries.move_to_end(key)
+    _total_bytes += size
+    evict(MAX_BYTES)
+    return artifact
+
+
+def get_table(file_path):
+    """Shared `SelectionTable` of a file, parsed on the first request and reused while the file is unchanged."""
+    return _get(("table", os.path.abspath(file_path)), file_path, lambda: SelectionTable(file_path))
+
+
+def get_log(file_path, multiclass=False, stream=False, lazy=False, **options):
+    """Shared `PredictionLog` of a file opened with these options, see `get_table`.
+
+    Logs are shared between callers, so treat them as read only. The remaining `options`
+    do not change the parsed frames and are only used when the log is opened.
+    """
+    key = ("log", os.path.abspath(file_path), multiclass, stream, lazy)
+    return _get(key, file_path, lambda: PredictionLog(file_path, multiclass=multiclass, stream=stream, lazy=lazy, **options))
+
+
+def evict(max_bytes):
+    """Drop the least recently used artifacts until the registry fits into `max_bytes`.
+
+    The most recently used artifact is always kept, even if it alone exceeds the budget.
+    """
+    global _total_bytes
+    while _total_bytes > max_bytes and len(_entries) > 1:
+        _, (_, _, size) = _entries.popitem(last=False)
+        _total_bytes -= size
+        stats["evictions"] += 1
+
+
+def clear():
+    global _total_bytes
+    _entries.clear()
+    _total_bytes = 0
+
+
+def summary():
+    requests = stats["hits"] + stats["misses"]
+    return f"artifact registry: {stats['hits']}/{requests} hits, {stats['misses']} parsed, {stats['evictions']} evicted"
@@ -0,0 +1,199 @@
+import argparse
+import io
+import json
+import os
+
+import soundfile as sf
+
+from spectrogram_image import spectrogram_name
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument(
+    "archives",
+    nargs="+",
+    help="Index files (*.segments.json) of the archives to unpack",
+)
+
+parser.add_argument(
+    "-a",
+    "--audio_output",
+    dest="audio_output",
+    help="Where the segments will be written as individual WAV files. If empty, the archives are only listed",
+)
+
+parser.add_argument(
+    "-s",
+    "--spectrogram_output",
+    dest="spectrogram_output",
+    help="Where the spectrogram images of the segments will be written, if the archive has them",
+)
+
+AUDIO_SUFFIX = ".segments.wav"
+IMAGE_SUFFIX = ".segments.png.bin"
+INDEX_SUFFIX = ".segments.json"
+# Sample format of the archives, the one sf.write uses for WAV files by default.
+SUBTYPE = "PCM_16"
+
+
+def archive_name(audio_file):
+    """Base name of the archive of a recording, its file name without extension."""
+    return os.path.splitext(os.path.basename(audio_file.strip()))[0]
+
+
+class ArchiveWriter:
+    """Packs the segments of one recording into a single WAV plus a JSON index.
+
+    The audio of the segments is appended to ``<name>.segments.wav`` in the sample format a
+    single segment WAV has, so unpacking gives back identical files. Spectrogram PNGs are
+    appended to ``<name>.segments.png.bin`` in `image_output`. ``<name>.segments.json``
+    lists name, class and frame offset/length (and image offset/length) of every segment.
+    With `append` an existing archive of the same name is continued instead of replaced.
+    """
+
+    def __init__(self, audio_output, name, recording=None, image_output=None, append=False):
+        self.name = name
+        self.index_path = os.path.join(audio_output, name + INDEX_SUFFIX)
+        self.audio_path = os.path.join(audio_output, name + AUDIO_SUFFIX)
+        self.image_path = os.path.join(image_output, name + IMAGE_SUFFIX) if image_output is not None else None
+        self.recording = recording
+        self.segments = []
+        self._audio = None
+        self._images = None
+        self._frames = 0
+        self._image_bytes = 0
+        self.sr = None
+        self.channels = None
+        if append and os.path.exists(self.index_path):
+            self._reopen()
+
+    def _reopen(self):
+        with open(self.index_path, "r") as f:
+            index = json.load(f)
+        self.segments = index["segments"]
+        self.sr = index["sr"]
+        self.channels = index["channels"]
+        if index["audio"] is not None:
+            self._audio = sf.SoundFile(self.audio_path, "r+")
+            self._frames = self._audio.seek(0, sf.SEEK_END)
+        if index["images"] is not None and self.image_path is not None:
+            self._images = open(self.image_path, "ab")
+            self._image_bytes = self._images.tell()
+
+    def add(self, name, wav, class_id=None, png=None):
+        """Append one segment, given as the bytes of its WAV file."""
+        audio, sr = sf.read(io.BytesIO(wav), dtype="int16", always_2d=True)
+        if self._audio is None:
+            self.sr = sr
+            self.channels = audio.shape[1]
+            self._audio = sf.SoundFile(self.audio_path, "w", samplerate=sr, channels=self.channels, subtype=SUBTYPE)
+        elif sr != self.sr or audio.shape[1] != self.channels:
+            raise ValueError(f"{name} has {sr} Hz / {audio.shape[1]} channels, the archive {self.sr} Hz / {self.channels}")
+        self._audio.write(audio)
+        entry = {"name": name, "class": class_id, "offset": self._frames, "length": len(audio)}
+        self._frames += len(audio)
+        if png is not None and self.image_path is not None:
+            if self._images is None:
+                self._images = open(self.image_path, "wb")
+            self._images.write(png)
+            entry["image_offset"] = self._image_bytes
+            entry["image_length"] = len(png)
+            self._image_bytes += len(png)
+        self.segments.append(entry)
+
+    def close(self):
+        if self._audio is not None:
+            self._audio.close()
+        if self._images is not None:
+            self._images.close()
+        index_dir = os.path.dirname(self.index_path)
+        index = {
+            "recording": self.recording,
+            "sr": self.sr,
+            "channels": self.channels,
+            "subtype": SUBTYPE,
+            "audio": os.path.relpath(self.audio_path, index_dir) if self._audio is not None else None,
+            "images": os.path.relpath(self.image_path, index_dir) if self._images is not None else None,
+            "segments": self.segments,
+        }
+        with open(self.index_path, "w") as f:
+            json.dump(index, f, indent=4)
+
+
+class SegmentArchive:
+    """Reads the segments of an archive written by `ArchiveWriter`, given its ``.segments.json`` index."""
+
+    def __init__(self, index_path):
+        with open(index_path, "r") as f:
+            self.index = json.load(f)
+        directory = os.path.dirname(index_path)
+        self.audio_path = os.path.join(directory, self.index["audio"]) if self.index["audio"] else None
+        self.image_path = os.path.join(directory, self.index["images"]) if self.index["images"] else None
+        self.sr = self.index["sr"]
+        self.segments = self.index["segments"]
+        self._by_name = {entry["name"]: entry for entry in self.segments}
+
+    def __len__(self):
+        return len(self.segments)
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    def names(self):
+        return [entry["name"] for entry in self.segments]
+
+    def read(self, name, dtype="float64"):
+        """Audio of a segment as ``(audio, sr)``, the same array ``sf.read`` returns for its WAV file."""
+        with sf.SoundFile(self.audio_path) as f:
+            return self._read(f, self._by_name[name], dtype), self.sr
+
+    def wav_bytes(self, name):
+        """The WAV file of a segment, byte-identical to the one `segment` writes."""
+        with sf.SoundFile(self.audio_path) as f:
+            return self._wav_bytes(f, self._by_name[name])
+
+    @staticmethod
+    def _read(f, entry, dtype):
+        f.seek(entry["offset"])
+        return f.read(entry["length"], dtype=dtype)
+
+    def _wav_bytes(self, f, entry):
+        buffer = io.BytesIO()
+        sf.write(buffer, self._read(f, entry, "int16"), self.sr, format="WAV", subtype=self.index["subtype"])
+        return buffer.getvalue()
+
+    def image(self, name):
+        """PNG bytes of the spectrogram of a segment, None if the archive has none."""
+        entry = self._by_name[name]
+        if self.image_path is None or "image_offset" not in entry:
+            return None
+        with open(self.image_path, "rb") as f:
+            f.seek(entry["image_offset"])
+            return f.read(entry["image_length"])
+
+    def unpack(self, audio_output, img_output=None):
+        """Write every segment as its own WAV (and PNG) file, named like `segment` names them."""
+        os.makedirs(audio_output, exist_ok=True)
+        if img_output is not None:
+            os.makedirs(img_output, exist_ok=True)
+        if self.audio_path is None:
+            return
+        with sf.SoundFile(self.audio_path) as f:
+            for entry in self.segments:
+                with open(os.path.join(audio_output, entry["name"]), "wb") as out:
+                    out.write(self._wav_bytes(f, entry))
+                png = self.image(entry["name"]) if img_output is not None else None
+                if png is not None:
+                    with open(os.path.join(img_output, spectrogram_name(entry["name"])), "wb") as out:
+                        out.write(png)
+
+if __name__ == '__main__':
+    ARGS = parser.parse_args()
+    for index_path in ARGS.archives:
+        archive = SegmentArchive(index_path)
+        if ARGS.audio_output is None:
+            for entry in archive:
+                print(f"{entry['name']}\t{entry['class']}\t{entry['offset']}\t{entry['length']}")
+            continue
+        archive.unpack(ARGS.audio_output, ARGS.spectrogram_output)
+        print(f"Unpacked {len(archive)} segments from {index_path}")
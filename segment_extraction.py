@@ -1,8 +1,21 @@
+import io
 import os
 import argparse
+import time
+import traceback
+from collections import deque
+
+import numpy as np
 import soundfile as sf
-import torch
-import matplotlib.pyplot as plt
+
+import log_cache
+import profiling
+from audio_io import iter_segments, iter_windows
+from grouping import non_smooth_segments, segment_records, smooth_segments
+from log_parser import CHUNK_SIZE, iter_chunks, parse_log, read_header
+from parallel import BackgroundWriter, resolve_workers
+from segment_archive import ArchiveWriter, archive_name
+from spectrogram_image import parse_size, render_png, spectrogram_name
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
@@ -26,6 +39,28 @@ parser.add_argument(
     help="Where the spectrograms of the extracted segments will be stored. If empty, no spectrograms will be created",
 )
 
+parser.add_argument(
+    "--image_size",
+    dest="image_size",
+    type=parse_size,
+    help="Size of the spectrogram images as WIDTHxHEIGHT pixels, e.g. 512x256. Default one pixel per STFT bin",
+)
+
+parser.add_argument(
+    "--spectrogram_axes",
+    dest="spectrogram_axes",
+    action="store_true",
+    help="Draw the segment name as title and frame/frequency axes around the spectrograms",
+)
+
+parser.add_argument(
+    "--reuse_stft",
+    dest="reuse_stft",
+    action="store_true",
+    help="Transform the audio of overlapping segments once and slice the spectrogram of every segment from it "
+         "instead of transforming each segment on its own. Their frames are aligned to the hop length",
+)
+
 parser.add_argument(
     "--smooth",
     dest="smooth",
@@ -41,6 +76,38 @@ parser.add_argument(
     help="A threshold for marking if a segment should be extracted. If not set, the threshold in the prediction file will be used",
 )
 
+parser.add_argument(
+    "--pack",
+    dest="pack",
+    choices=["recording", "run"],
+    help="Pack the segments into one archive per recording or per run instead of one WAV/PNG file each, "
+         "see segment_archive.py to read or unpack them",
+)
+
+parser.add_argument(
+    "--workers",
+    dest="workers",
+    type=int,
+    default=1,
+    help="Number of processes parsing, reading and encoding the logs, 0 uses every CPU. Default 1",
+)
+
+parser.add_argument(
+    "--batch-size",
+    dest="batch_size",
+    type=int,
+    default=16,
+    help="Segments read and encoded at once when running without workers. Default 16",
+)
+
+profiling.add_arguments(parser)
+
+
+
+# STFT parameters of the segment spectrograms. torch is imported by the spectrogram code
+# only, extracting audio without images never loads it.
+N_FFT = 1024
+HOP_LENGTH = 128
 
 
 class Spectrogram(object):
@@ -53,6 +120,8 @@ class Spectrogram(object):
     """
 
     def __init__(self, n_fft, hop_length, center=True, return_complex=False):
+        import torch
+
         self.n_fft = n_fft
         self.hop_length = hop_length
         self.center = center
@@ -60,19 +129,23 @@ class Spectrogram(object):
         self.return_complex = return_complex
 
     def __call__(self, y):
+        import torch
+
         if y.dim() != 2:
             raise ValueError(
                 "Spectrogram expects a 2 dimensional signal of size (c, n), "
                 "but got size: {}.".format(y.size())
             )
-        S = torch.stft(
+        # Recent torch versions only return complex STFTs, view_as_real restores the (..., 2) layout.
+        S = torch.view_as_real(torch.stft(
             input=y,
             n_fft=self.n_fft,
             hop_length=self.hop_length,
             window=self.window,
             center=self.center,
-            onesided=True
-        ).transpose(1, 2)
+            onesided=True,
+            return_complex=True
+        )).transpose(1, 2)
         S /= self.window.pow(2).sum().sqrt()
         if not self.return_complex:
             return S.pow(2).sum(-1)  # get power of "complex" tensor (c, l, n_fft)
@@ -80,141 +153,163 @@ class Spectrogram(object):
             return S
 
 
+class RecordingSpectrogram:
+    """Power spectrogram of a stretch of a recording, transformed once and sliced per segment.
+
+    `audio` are the samples from `offset` on. Frame ``k`` is centred on sample
+    ``offset + k * hop_length``, as with ``center=True`` on the whole stretch, and the last
+    frame is the first one centred at or past its end. The STFT runs on `chunk_frames`
+    frames at a time, which gives the same frames as one transform.
+    """
+
+    def __init__(self, audio, offset=0, n_fft=N_FFT, hop_length=HOP_LENGTH, chunk_frames=8192):
+        import torch
+
+        self.offset = offset
+        self.hop_length = hop_length
+        transform = Spectrogram(n_fft=n_fft, hop_length=hop_length, center=False)
+        # A segment ending with the stretch whose start is rounded up needs the frame past its end.
+        n_frames = 1 + -(-len(audio) // hop_length)
+        padding = (n_fft // 2, n_fft // 2 + (n_frames - 1) * hop_length - len(audio))
+        signal = torch.from_numpy(audio).unsqueeze(0)
+        signal = torch.nn.functional.pad(signal.unsqueeze(0), padding, mode="reflect")[0]
+        chunks = []
+        for first in range(0, n_frames, chunk_frames):
+            last = min(first + chunk_frames, n_frames)
+            chunks.append(transform(signal[:, first * hop_length:(last - 1) * hop_length + n_fft])[0])
+        self.power = torch.cat(chunks)
+
+    def segment(self, start, stop):
+        """Frames x bins power of the samples [start, stop), with as many frames as a direct transform.
+
+        The first frame is the one whose centre is closest to `start`, so the frames are those of
+        a direct transform of the audio shifted by less than half a hop. Frames away from the
+        segment edges match exactly when `start` lies on the hop grid, the edge frames see the
+        neighbouring audio where a direct transform pads by reflection.
+        """
+        first = int(round((start - self.offset) / self.hop_length))
+        return self.power[first:first + 1 + (stop - start) // self.hop_length]
+
+
 class PredictionLog:
-    def __init__(self, file_path, non_noise_threshold=None, binary=True):
+    def __init__(self, file_path, non_noise_threshold=None, binary=True, stream=False, use_cache=True):
         self.log_file = file_path
         self.audio_file = ""
         self.binary = binary
         self.used_threshold = non_noise_threshold
-        self.data = self._init_data()
+        self.use_cache = use_cache
+        self.frames = None
+        self._data = None
+        if stream:
+            self.audio_file = read_header(self.log_file)
+        else:
+            self.frames = self._init_data()
+
+    @property
+    def data(self):
+        if self._data is None:
+            if self.frames is None:
+                raise ValueError(f"{self.log_file} was opened with stream=True, iterate iter_data() instead")
+            self._data = self._records(self.frames)
+        return self._data
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        frames = self.frames
+        if frames is None:
+            cached = log_cache.load(self.log_file, self._cache_variant()) if self.use_cache else None
+            if cached is None:
+                yield from iter_chunks(self.log_file, not self.binary, chunk_size)
+                return
+            frames = cached[1]
+        for start in range(0, len(frames), chunk_size):
+            yield frames.slice(start, start + chunk_size)
+
+    def iter_data(self, chunk_size=CHUNK_SIZE):
+        if self._data is not None:
+            yield from self._data
+            return
+        for chunk in self.iter_chunks(chunk_size):
+            yield from self._records(chunk)
 
     def is_positive(self, probability, prediction):
         if self.used_threshold is not None:
             return probability > self.used_threshold
         return prediction
 
-    def _get_line_content(self, line):
-        components = line.split("|")
-        return components[-1]
+    def _grouping_input(self, frames, smooth):
+        positive = np.asarray(self.is_positive(frames.prob, frames.pred), dtype=bool)
+        code = positive.astype(np.int64) if self.binary else frames.label
+        if not smooth:
+            return frames.start_t, frames.end_t, code
+        return frames.start_t[positive], frames.end_t[positive], code[positive]
 
-    def _get_key_value(self, pair):
-        components = pair.split("=")
-        return components[0], components[1].rstrip()
+    def segments(self, smooth=True):
+        """The grouped events of the log as `Segments` arrays."""
+        labels = []
 
-    def _group_smooth(self):
-        grouped = []
+        def chunks():
+            for frames in self.iter_chunks():
+                labels[:] = frames.labels
+                yield self._grouping_input(frames, smooth)
 
-        data = [l for l in self.data if self.is_positive(float(l["prob"]), int(l["pred"]))]
-        if len(data) == 0:
-            return grouped
-
-        group = {
-            "start_t": data[0]["start_t"],
-            "end_t": data[0]["end_t"],
-            "class_id": data[0]["class_id"]
-        }
-        for l in data[1:]:
-            if l["class_id"] == group["class_id"] and l["start_t"] < group["end_t"]:
-                group["end_t"] = l["end_t"]
-            elif l["class_id"] != group["class_id"] and l["start_t"] < group["end_t"]:
-                continue
-            else:
-                grouped.append(group)
-                group = {
-                    "start_t": l["start_t"],
-                    "end_t": l["end_t"],
-                    "class_id": l["class_id"]
-                }
-        return grouped
+        with profiling.stage("group"):
+            segments = smooth_segments(chunks()) if smooth else non_smooth_segments(chunks())
+        class_names = ["noise", "target"] if self.binary else labels
+        return segments._replace(class_id=np.asarray(class_names, dtype=object)[segments.class_id])
 
+    def _group_smooth(self):
+        return segment_records(self.segments(smooth=True))
 
     def _group_non_smooth(self):
-        grouped = []
-
-        start_t = 0.0
-        end_t = 0.0
-        class_id = None
-
-        for idx, line in enumerate(self.data):
-            if class_id is None:
-                class_id = line["class_id"]
-                end_t = line["end_t"]
-                continue
-            if line["class_id"] != class_id:
-                grouped.append({
-                    "start_t": start_t,
-                    "end_t": end_t,
-                    "class_id": class_id
-                })
-                start_t = line["start_t"]
-                end_t = line["end_t"]
-                class_id = line["class_id"]
-                continue
-            if line["class_id"] == class_id:
-                end_t = line["end_t"]
-
-        return grouped
+        return segment_records(self.segments(smooth=False))
 
     def group(self, smooth=True):
         if smooth:
             return self._group_smooth()
         return self._group_non_smooth()
 
+    def _cache_variant(self):
+        return "binary" if self.binary else "multiclass"
+
     def _init_data(self):
-        with open(self.log_file, "r") as f:
-            lines = f.readlines()
-        data = []
-        for idx in range(len(lines)):
-            line = lines[idx]
-            if idx == 0:
-                self.audio_file = self._get_line_content(line)
-                continue
-            if "|time=" in line:
-                content = self._get_line_content(line)
-                fields = content.split(", ")
-                time = self._get_key_value(fields[0])
-                t_start = time[1].split("-")[0]
-                t_end = time[1].split("-")[1]
-                pred = int(self._get_key_value(fields[1])[1])
-                if self.binary:
-                    prob = float(self._get_key_value(fields[2])[1])
-                    pred_class = "target" if self.is_positive(prob, pred) else "noise"
-                else:
-                    pred_class = self._get_key_value(fields[2])[1]
-                    prob = float(self._get_key_value(fields[3])[1])
-
-                active_entry = {
-                    "start_t": float(t_start),
-                    "end_t": float(t_end),
-                    "class_id": pred_class,
-                    "prob": float(prob),
-                    "pred": int(pred),
-                    "classes": {}
-                }
-                idx += 1
-                line = lines[idx]
-                if "output_layer" in line:
-                    idx += 1
-                    line = lines[idx]
-
-                if not self.binary:
-                    while len(line.rstrip()) > 0:
-                        c, p = line.split("=")
-                        p = float(p.replace(";", "").rstrip())
-                        active_entry["classes"][c] = p
-                        idx += 1
-                        line = lines[idx]
-                data.append(active_entry)
-        return data
-
-    def load_spectrogram(self, audio_data, title: str, output: str):
-        spectrogram = Spectrogram(hop_length=128, n_fft=1024)(torch.from_numpy(audio_data).unsqueeze(0))[0].T
-        figure, ax = plt.subplots(dpi=300)
-        plt.title(title)
+        if self.use_cache:
+            cached = log_cache.load(self.log_file, self._cache_variant())
+            if cached is not None:
+                header, frames = cached
+                self.audio_file = header["audio_file"]
+                return frames
+        with profiling.stage("parse_logs"):
+            self.audio_file, frames = parse_log(self.log_file, multiclass=not self.binary)
+        if self.use_cache:
+            log_cache.store(self.log_file, self._cache_variant(), {"audio_file": self.audio_file}, frames)
+        return frames
+
+    def _records(self, frames):
+        if self.binary:
+            positive = self.is_positive(frames.prob, frames.pred).astype(bool).tolist()
+            class_ids = ["target" if p else "noise" for p in positive]
+            classes = [{} for _ in class_ids]
+        else:
+            class_ids = frames.label_names().tolist()
+            classes = frames.class_dicts()
+        return [
+            {
+                "start_t": start_t,
+                "end_t": end_t,
+                "class_id": class_id,
+                "prob": prob,
+                "pred": pred,
+                "classes": cl
+            }
+            for start_t, end_t, prob, pred, class_id, cl
+            in zip(frames.start_t.tolist(), frames.end_t.tolist(), frames.prob.tolist(), frames.pred.tolist(),
+                   class_ids, classes)
+        ]
+
+    def load_spectrogram(self, audio_data, title: str, output: str, image_size=None, with_axes=False):
         os.makedirs(output, exist_ok=True)
-        plt.imshow(torch.log(spectrogram), origin="lower", interpolation=None)
-        plt.savefig(os.path.join(output, f"{title.replace(' ', '')}.png"), bbox_inches="tight")
-        plt.close(figure)
+        with open(os.path.join(output, spectrogram_name(title)), "wb") as f:
+            f.write(render_spectrogram(audio_data, title, image_size, with_axes))
 
 
     def get_segment_name(self, start_s, end_s, idx):
@@ -223,25 +318,292 @@ class PredictionLog:
         return basename
 
 
-    def segment(self, audio_output, img_output=None, smooth_predictions=True):
-        grouped_events = self.group(smooth_predictions)
-        source_audio, sr = sf.read(self.audio_file.strip())
+    def segment_classes(self, segments):
+        """Name and class of every event of `segments`, see `get_segment_name`."""
+        return {
+            self.get_segment_name(start_s, end_s, idx): class_id
+            for idx, (start_s, end_s, class_id)
+            in enumerate(zip(segments.start_t.tolist(), segments.end_t.tolist(), segments.class_id.tolist()))
+        }
+
+    def iter_segments(self, smooth_predictions=True, segments=None):
+        """Yield ``(name, audio, sr)`` for every event of the log, in file order.
+
+        Only the audio around the events is read, nearby events share one read. Pass
+        `segments` if the events are already grouped.
+        """
+        if segments is None:
+            segments = self.segments(smooth_predictions)
+        start_t = segments.start_t.tolist()
+        end_t = segments.end_t.tolist()
+        for idx, audio_slice, sr in iter_segments(self.audio_file.strip(), start_t, end_t):
+            yield self.get_segment_name(start_t[idx], end_t[idx], idx), audio_slice, sr
+
+    def iter_windows(self, smooth_predictions=True, segments=None):
+        """Yield ``(sr, window_start, audio, segments)`` per read window, see `audio_io.iter_windows`.
+
+        `segments` lists the ``(name, start, stop)`` sample ranges of the events in the window.
+        """
+        if segments is None:
+            segments = self.segments(smooth_predictions)
+        start_t = segments.start_t.tolist()
+        end_t = segments.end_t.tolist()
+        for sr, window_start, audio, ranges in iter_windows(self.audio_file.strip(), start_t, end_t):
+            named = [(self.get_segment_name(start_t[idx], end_t[idx], idx), start, stop) for idx, start, stop in ranges]
+            yield sr, window_start, audio, named
+
+    def segment(self, audio_output, img_output=None, smooth_predictions=True, image_size=None, with_axes=False):
         os.makedirs(audio_output, exist_ok=True)
         if img_output is not None:
             os.makedirs(img_output, exist_ok=True)
 
-        for idx, event in enumerate(grouped_events):
-            audio_slice = source_audio[int(event['start_t'] * sr): int(event['end_t'] * sr)]
-            name = self.get_segment_name(event['start_t'], event['end_t'], idx)
+        for name, audio_slice, sr in self.iter_segments(smooth_predictions):
             print(name)
             if img_output is not None:
-                self.load_spectrogram(audio_slice, name, img_output)
+                self.load_spectrogram(audio_slice, name, img_output, image_size, with_axes)
             sf.write(os.path.join(audio_output, name), audio_slice, sr)
 
 
+def render_spectrogram(audio_data, title: str, image_size=None, with_axes=False):
+    """The log-power spectrogram image of a segment as PNG bytes.
+
+    By default the image has one pixel per STFT bin. `image_size` (``(width, height)``)
+    resamples it, `with_axes` adds the title and axes.
+    """
+    return render_power(spectrogram_power(audio_data), title, image_size, with_axes)
+
+
+def spectrogram_power(audio_data):
+    """Frames x bins power spectrogram of a segment on its own."""
+    with profiling.stage("stft"):
+        import torch
+
+        return Spectrogram(hop_length=HOP_LENGTH, n_fft=N_FFT)(torch.from_numpy(audio_data).unsqueeze(0))[0]
+
+
+def render_power(power, title: str, image_size=None, with_axes=False):
+    """PNG bytes of a frames x bins power spectrogram, see `render_spectrogram`."""
+    import torch
+
+    with profiling.stage("render_png"):
+        png = render_png(torch.log(power.T).numpy(), title, image_size, with_axes)
+    profiling.count("spectrograms_rendered")
+    return png
+
+
+def _encode_wav(audio, sr):
+    with profiling.stage("encode_wav"):
+        buffer = io.BytesIO()
+        sf.write(buffer, audio, sr, format="WAV")
+    profiling.count("wavs_encoded")
+    return buffer.getvalue()
+
+
+def encode_segments(batch, with_spectrogram, image_size=None, with_axes=False):
+    """Encode a batch of ``(name, audio, sr)`` segments as ``(name, wav_bytes, png_bytes)``."""
+    encoded = []
+    for name, audio, sr in batch:
+        png = render_spectrogram(audio, name, image_size, with_axes) if with_spectrogram else None
+        encoded.append((name, _encode_wav(audio, sr), png))
+    return encoded
+
+
+def overlapping_runs(segments):
+    """Split ``(name, start, stop)`` segments in start order into runs where each overlaps the run before it."""
+    runs = []
+    run_stop = None
+    for segment in segments:
+        if runs and segment[1] < run_stop:
+            runs[-1].append(segment)
+            run_stop = max(run_stop, segment[2])
+        else:
+            runs.append([segment])
+            run_stop = segment[2]
+    return runs
+
+
+def window_spectrograms(window_start, audio, segments):
+    """Power spectrogram of every ``(name, start, stop)`` segment of a read window, in order.
+
+    Overlapping segments share one `RecordingSpectrogram` of the audio they cover, so their
+    frames are those described in `RecordingSpectrogram.segment`. A transform of the whole
+    window would also cover the gaps between sparse segments, a segment that overlaps no
+    other one is transformed on its own like `render_spectrogram` does.
+    """
+    for run in overlapping_runs(segments):
+        if len(run) == 1:
+            name, start, stop = run[0]
+            yield spectrogram_power(audio[start - window_start:stop - window_start])
+            continue
+        run_start = run[0][1]
+        run_stop = max(stop for _, _, stop in run)
+        with profiling.stage("stft"):
+            spectrogram = RecordingSpectrogram(audio[run_start - window_start:run_stop - window_start], run_start)
+        profiling.count("shared_stfts")
+        for name, start, stop in run:
+            yield spectrogram.segment(start, stop)
+
+
+def encode_window(window, image_size=None, with_axes=False):
+    """Like `encode_segments` for all segments of a read window, see `window_spectrograms`."""
+    sr, window_start, audio, segments = window
+    encoded = []
+    for (name, start, stop), power in zip(segments, window_spectrograms(window_start, audio, segments)):
+        audio_slice = audio[start - window_start:stop - window_start]
+        png = render_power(power, name, image_size, with_axes)
+        encoded.append((name, _encode_wav(audio_slice, sr), png))
+    return encoded
+
+
+def _batches(segments, batch_size):
+    batch = []
+    for segment in segments:
+        batch.append(segment)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _encoded_batches(log, segments, smooth, with_spectrogram, batch_size, image_size, with_axes, reuse_stft):
+    if reuse_stft and with_spectrogram:
+        for window in log.iter_windows(smooth, segments):
+            with profiling.stage("encode"):
+                encoded = encode_window(window, image_size, with_axes)
+            yield encoded
+        return
+    for batch in _batches(log.iter_segments(smooth, segments), batch_size):
+        with profiling.stage("encode"):
+            encoded = encode_segments(batch, with_spectrogram, image_size, with_axes)
+        yield encoded
+
+
+def encode_log(log_file, threshold=None, smooth=True, with_spectrogram=False, batch_size=16, image_size=None,
+               with_axes=False, reuse_stft=False, stream=False):
+    """Parse and group one log, read the audio around its events and encode every segment.
+
+    Returns the audio file, the class of every segment name and the encoded
+    ``(name, wav_bytes, png_bytes)`` segments in batches. With `stream` the batches are a
+    generator that reads and encodes `batch_size` segments (or one read window with
+    `reuse_stft`) at a time, otherwise they are encoded up front into one list, which is
+    what a worker process sends back.
+    """
+    log = PredictionLog(log_file, threshold)
+    segments = log.segments(smooth)
+    batches = _encoded_batches(log, segments, smooth, with_spectrogram, batch_size, image_size, with_axes, reuse_stft)
+    if not stream:
+        batches = [[segment for batch in batches for segment in batch]]
+    return log.audio_file.strip(), log.segment_classes(segments), batches
+
+
+def extract_segments(files, audio_output, img_output=None, threshold=None, smooth=True, workers=1, batch_size=16,
+                     image_size=None, with_axes=False, reuse_stft=False, pack=None):
+    """Extract the segments of many logs with a pipeline of workers and a writer.
+
+    Every log is parsed, grouped, read and encoded (WAV and optionally the spectrogram PNG)
+    as one task on `workers` processes and the encoded segments are written by a background
+    thread. At most two logs per worker are in flight and the writer queue is bounded, so
+    memory is bounded by the segments of a few logs. With a single worker the logs are
+    processed in this process `batch_size` segments at a time. With `reuse_stft` the
+    overlapping segments of a read window share one transform. With `pack` ("recording" or "run") the
+    segments go into one `segment_archive` per recording or for the whole run instead of
+    a file each. Returns the number of extracted segments.
+    """
+    started = time.time()
+    os.makedirs(audio_output, exist_ok=True)
+    if img_output is not None:
+        os.makedirs(img_output, exist_ok=True)
+    with_spectrogram = img_output is not None
+    workers = resolve_workers(workers)
+    writer = BackgroundWriter(maxsize=4 * batch_size)
+    pool = None
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        if with_spectrogram:
+            # Import torch once before the workers start instead of once per worker.
+            import torch  # noqa: F401
+
+        pool = ProcessPoolExecutor(max_workers=workers)
+    options = (threshold, smooth, with_spectrogram, batch_size, image_size, with_axes, reuse_stft)
+    pending = deque()
+    extracted = 0
+    archive = None
+    # Archives closed in this run, a recording whose logs are not consecutive appends to its archive.
+    packed = set()
+    packed_bytes = 0
+
+    def archive_for(audio_file):
+        nonlocal archive
+        name = "run" if pack == "run" else archive_name(audio_file)
+        if archive is not None and archive.name != name:
+            archive.close()
+            packed.add(archive.name)
+            archive = None
+        if archive is None:
+            archive = ArchiveWriter(audio_output, name, audio_file if pack == "recording" else None, img_output,
+                                    append=name in packed)
+        return archive
+
+    def write(audio_file, segment_classes, encoded):
+        nonlocal extracted, packed_bytes
+        for name, wav, png in encoded:
+            print(name)
+            if pack is not None:
+                archive_for(audio_file).add(name, wav, segment_classes.get(name), png)
+                packed_bytes += len(wav) + (len(png) if png is not None else 0)
+            else:
+                if png is not None:
+                    writer.put(os.path.join(img_output, spectrogram_name(name)), png)
+                writer.put(os.path.join(audio_output, name), wav)
+            extracted += 1
+        profiling.count("segments_written", len(encoded))
+        profiling.count("spectrograms_written", sum(png is not None for _, _, png in encoded))
+        profiling.count("segment_bytes_written", sum(len(wav) + len(png or b"") for _, wav, png in encoded))
+
+    def collect():
+        log_file, future = pending.popleft()
+        try:
+            with profiling.stage("wait_for_workers"):
+                audio_file, segment_classes, batches = future.result()
+            for encoded in batches:
+                write(audio_file, segment_classes, encoded)
+        except Exception:
+            print(f"Failed to process {log_file}:\n{traceback.format_exc()}")
+
+    try:
+        for log_file in files:
+            profiling.count("logs")
+            if pool is not None:
+                pending.append((log_file, pool.submit(encode_log, log_file, *options)))
+                while len(pending) > 2 * workers:
+                    collect()
+                continue
+            try:
+                audio_file, segment_classes, batches = encode_log(log_file, *options, stream=True)
+                for encoded in batches:
+                    write(audio_file, segment_classes, encoded)
+            except Exception:
+                print(f"Failed to process {log_file}:\n{traceback.format_exc()}")
+        while pending:
+            collect()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        writer.close()
+        if archive is not None:
+            archive.close()
+
+    elapsed = time.time() - started
+    print(f"Extracted {extracted} segments from {len(files)} logs in {elapsed:.1f}s "
+          f"({extracted / max(elapsed, 1e-9):.1f} segments/s, {(writer.bytes + packed_bytes) / 1024 / 1024:.1f} MB written)")
+    return extracted
+
+
 def run_segment(f, args):
     pl = PredictionLog(f, args.threshold)
-    pl.segment(args.audio_output, args.spectrogram_output, args.smooth)
+    pl.segment(args.audio_output, args.spectrogram_output, args.smooth, args.image_size, args.spectrogram_axes)
 
 
 if __name__ == '__main__':
@@ -250,5 +612,7 @@ if __name__ == '__main__':
         files = [os.path.join(ARGS.input, f) for f in os.listdir(ARGS.input) if f.endswith("predict_output.log")]
     else:
         files = [ARGS.input]
-    for file in files:
-        run_segment(file, ARGS)
+    with profiling.session(ARGS):
+        extract_segments(files, ARGS.audio_output, ARGS.spectrogram_output, ARGS.threshold, ARGS.smooth,
+                         ARGS.workers, ARGS.batch_size, ARGS.image_size, ARGS.spectrogram_axes, ARGS.reuse_stft,
+                         ARGS.pack)
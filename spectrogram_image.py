@@ -0,0 +1,111 @@
+import struct
+import zlib
+
+import numpy as np
+
+# Colormap of the images, the default colormap of matplotlib's imshow.
+COLORMAP = "viridis"
+
+_luts = {}
+
+
+def colormap_lut(name=COLORMAP):
+    """256 x 3 uint8 lookup table of a matplotlib colormap."""
+    if name not in _luts:
+        from matplotlib import colormaps
+
+        _luts[name] = (colormaps[name](np.linspace(0.0, 1.0, 256))[:, :3] * 255).round().astype(np.uint8)
+    return _luts[name]
+
+
+def spectrogram_name(title):
+    """File name of the spectrogram image of a segment."""
+    return f"{title.replace(' ', '')}.png"
+
+
+def parse_size(size):
+    """``"WIDTHxHEIGHT"`` as a ``(width, height)`` tuple, None stays None."""
+    if size is None:
+        return None
+    width, height = size.lower().split("x")
+    return int(width), int(height)
+
+
+def to_indices(values, size=None):
+    """Scale a frequency x time matrix to colormap indices, low frequencies at the bottom.
+
+    Values are scaled linearly between their finite minimum and maximum, like imshow's
+    default normalization; non-finite values get the lowest color. With `size`
+    (``(width, height)`` in pixels) the image is resampled with nearest neighbours.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    finite = np.isfinite(values)
+    if not np.any(finite):
+        index = np.zeros(values.shape, dtype=np.uint8)
+    else:
+        low = values[finite].min()
+        span = values[finite].max() - low
+        scaled = np.where(finite, values - low, 0.0) * (255.0 / span if span > 0 else 0.0)
+        index = np.clip(scaled, 0, 255).astype(np.uint8)
+    index = index[::-1]
+    if size is not None:
+        width, height = size
+        rows = np.arange(height) * index.shape[0] // height
+        cols = np.arange(width) * index.shape[1] // width
+        index = index[rows[:, None], cols[None, :]]
+    return index
+
+
+def to_image(values, size=None, colormap=COLORMAP):
+    """Colormap a frequency x time matrix into an RGB image, see `to_indices`."""
+    return colormap_lut(colormap)[to_indices(values, size)]
+
+
+def _chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+
+def encode_png(pixels, palette=None, compression=3):
+    """Encode a ``height x width x 3`` RGB array, or a ``height x width`` array of `palette` indices, as PNG bytes.
+
+    An indexed image with a 256 x 3 palette is a third of the size to compress.
+    """
+    pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+    height, width = pixels.shape[:2]
+    channels = 1 if palette is not None else 3
+    rows = np.zeros((height, width * channels + 1), dtype=np.uint8)
+    rows[:, 1:] = pixels.reshape(height, width * channels)
+    chunks = [
+        b"\x89PNG\r\n\x1a\n",
+        _chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3 if palette is not None else 2, 0, 0, 0)),
+    ]
+    if palette is not None:
+        chunks.append(_chunk(b"PLTE", np.ascontiguousarray(palette, dtype=np.uint8).tobytes()))
+    chunks.append(_chunk(b"IDAT", zlib.compress(rows.tobytes(), compression)))
+    chunks.append(_chunk(b"IEND", b""))
+    return b"".join(chunks)
+
+
+def annotate(rgb, title, size=None):
+    """Draw the image with a title and frame/frequency-bin axes on an Agg canvas, without pyplot."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    width, height = size if size is not None else (max(rgb.shape[1], 480), max(rgb.shape[0], 360))
+    figure = Figure(figsize=(width / 100, height / 100), dpi=100)
+    canvas = FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+    ax.imshow(rgb[::-1], origin="lower", aspect="auto", interpolation="nearest")
+    ax.set_title(title, fontsize=8)
+    ax.set_xlabel("frame")
+    ax.set_ylabel("frequency bin")
+    figure.subplots_adjust(left=0.12, right=0.97, bottom=0.14, top=0.9)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba())[..., :3]
+
+
+def render_png(values, title=None, size=None, with_axes=False):
+    """PNG bytes of a frequency x time matrix, optionally with title and axes."""
+    if with_axes:
+        return encode_png(annotate(to_image(values), title, size))
+    return encode_png(to_indices(values, size), palette=colormap_lut())
@@ -0,0 +1,168 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from file_map import FileMap
+from intervals import ranges
+import registry
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument(
+    "--file_map",
+    dest="file_map",
+    default="results/file_map.json",
+    help="File map written by mapping.py, pairs the ground truth tables with their binary logs",
+)
+
+parser.add_argument(
+    "--thresholds",
+    dest="thresholds",
+    type=float,
+    nargs="+",
+    help="Thresholds to evaluate",
+)
+
+parser.add_argument(
+    "--threshold_range",
+    dest="threshold_range",
+    type=float,
+    nargs=3,
+    metavar=("START", "STOP", "STEP"),
+    help="Evaluate every threshold in [START, STOP) in steps of STEP",
+)
+
+parser.add_argument(
+    "--output",
+    dest="output",
+    help="CSV file for the results. If empty, they are only printed",
+)
+
+
+def _count_above(values, thresholds, weights=None):
+    """For every threshold the number of values strictly above it, or the sum of their weights."""
+    order = np.argsort(values, kind="stable")
+    above = len(values) - np.searchsorted(values[order], thresholds, side="right")
+    if weights is None:
+        return above
+    cumulative = np.concatenate([[0.0], np.cumsum(weights[order][::-1])])
+    return cumulative[above]
+
+
+def sweep_log(frames, thresholds, gt_start, gt_end):
+    """Evaluate the events of one binary log at every threshold in a single pass.
+
+    A frame is positive at threshold `t` if its probability is above `t`, and positive frames
+    are grouped like `segment_extraction.PredictionLog.group()` does, except that the last event
+    is counted as well. `gt_start`/`gt_end` are the annotations in seconds relative to the
+    start of the log. Intervals overlap if they share at least one point.
+
+    Returns the number of events, their total duration, the number of events overlapping an
+    annotation (one value per threshold each) and the highest probability of any frame
+    overlapping each annotation, which is above `t` exactly when the annotation is detected.
+    """
+    start_t, end_t, prob = frames.start_t, frames.end_t, frames.prob
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    if np.any(np.diff(start_t) < 0) or np.any(np.diff(end_t) < 0):
+        raise ValueError("the frames of a prediction log have to be in chronological order")
+
+    # Frames overlapping an annotation form the range [lo, hi) of the sorted frames.
+    lo = np.searchsorted(end_t, gt_start, side="left")
+    hi = np.maximum(np.searchsorted(start_t, gt_end, side="right"), lo)
+    flat, offsets = ranges(lo, hi)
+    gt_max_prob = np.full(len(lo), -np.inf)
+    detectable = hi > lo
+    if np.any(detectable):
+        gt_max_prob[detectable] = np.maximum.reduceat(prob[flat], offsets[detectable])
+    coverage = np.zeros(len(prob) + 1, dtype=np.int64)
+    np.add.at(coverage, lo, 1)
+    np.add.at(coverage, hi, -1)
+    on_gt = np.cumsum(coverage[:-1]) > 0
+
+    joined = start_t[1:] < end_t[:-1]
+    if len(prob) < 3 or np.all(start_t[2:] >= end_t[:-2]):
+        # Only neighbouring frames overlap, so two positive frames belong to the same event
+        # exactly when every frame between them is positive and overlaps its successor. All
+        # counts are then sums over values above the threshold, no regrouping is needed.
+        pair_prob = np.minimum(prob[:-1], prob[1:])[joined]
+        events = _count_above(prob, thresholds) - _count_above(pair_prob, thresholds)
+        duration = _count_above(prob, thresholds, end_t - start_t) \
+            - _count_above(pair_prob, thresholds, (end_t[:-1] - start_t[1:])[joined])
+
+        flagged = np.flatnonzero(on_gt)
+        bridge = np.empty(0)
+        if len(flagged) > 1:
+            gaps = np.concatenate([[0], np.cumsum(~joined)])
+            bridge = np.minimum(np.minimum.reduceat(prob, flagged)[:-1], prob[flagged[1:]])
+            bridge[gaps[flagged[1:]] - gaps[flagged[:-1]] > 0] = -np.inf
+        matched = _count_above(prob[flagged], thresholds) - _count_above(bridge, thresholds)
+        return events, duration, matched, gt_max_prob
+
+    events = np.zeros(len(thresholds), dtype=np.int64)
+    duration = np.zeros(len(thresholds))
+    matched = np.zeros(len(thresholds), dtype=np.int64)
+    for k, threshold in enumerate(thresholds):
+        positive = np.flatnonzero(prob > threshold)
+        if len(positive) == 0:
+            continue
+        new_event = np.ones(len(positive), dtype=bool)
+        new_event[1:] = start_t[positive[1:]] >= end_t[positive[:-1]]
+        first = np.flatnonzero(new_event)
+        last = np.append(first[1:] - 1, len(positive) - 1)
+        events[k] = len(first)
+        duration[k] = np.sum(end_t[positive[last]] - start_t[positive[first]])
+        matched[k] = np.count_nonzero(np.maximum.reduceat(on_gt[positive], first))
+    return events, duration, matched, gt_max_prob
+
+
+def sweep(file_map: FileMap, thresholds):
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    events = np.zeros(len(thresholds), dtype=np.int64)
+    duration = np.zeros(len(thresholds))
+    matched = np.zeros(len(thresholds), dtype=np.int64)
+    gt_detected = np.zeros(len(thresholds), dtype=np.int64)
+    gt_events = 0
+    for gt_file, binary_logs in file_map.gt_pred_map.items():
+        table = registry.get_table(gt_file)
+        gt_begin = table.data.iloc[:, 3].to_numpy(dtype=np.float64)
+        gt_end = table.data.iloc[:, 4].to_numpy(dtype=np.float64)
+        gt_max_prob = np.full(len(gt_begin), -np.inf)
+        for log_file in binary_logs:
+            log = registry.get_log(log_file)
+            offset = (log.start_date_time - table.start_date_time).total_seconds()
+            log_events, log_duration, log_matched, log_gt_max = sweep_log(
+                log.frames, thresholds, gt_begin - offset, gt_end - offset
+            )
+            events += log_events
+            duration += log_duration
+            matched += log_matched
+            gt_max_prob = np.maximum(gt_max_prob, log_gt_max)
+        gt_events += len(gt_begin)
+        gt_detected += _count_above(gt_max_prob, thresholds)
+
+    return pd.DataFrame({
+        "threshold": thresholds,
+        "events": events,
+        "duration_s": duration,
+        "matched_events": matched,
+        "precision": matched / np.maximum(events, 1),
+        "ground_truth_events": gt_events,
+        "detected_ground_truth_events": gt_detected,
+        "recall": gt_detected / max(gt_events, 1),
+    })
+
+
+if __name__ == '__main__':
+    ARGS = parser.parse_args()
+    if ARGS.thresholds is not None:
+        values = ARGS.thresholds
+    elif ARGS.threshold_range is not None:
+        values = np.arange(*ARGS.threshold_range)
+    else:
+        parser.error("pass --thresholds or --threshold_range")
+    results = sweep(FileMap(ARGS.file_map), values)
+    print(results.to_string(index=False))
+    if ARGS.output is not None:
+        results.to_csv(ARGS.output, index=False)
+    print(registry.summary())
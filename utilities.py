@@ -1,5 +1,10 @@
 from datetime import timedelta
 from collections import namedtuple
+
+import numpy as np
+
+from log_parser import LogFrames
+
 Range = namedtuple('Range', ['start', 'end'])
 
 
@@ -22,6 +27,17 @@ def time_overlap(xlist, ylist):
     return a
 
 
+def seconds_to_timedelta64(seconds):
+    """Seconds as a timedelta64[us] array, rounded exactly like ``timedelta(seconds=...)``.
+
+    Like `datetime.timedelta`, the fraction is rounded separately from the whole seconds,
+    which keeps ties at half a microsecond on the same side.
+    """
+    fraction, whole = np.modf(np.asarray(seconds, dtype=np.float64))
+    microseconds = whole.astype(np.int64) * 1000000 + np.round(fraction * 1e6).astype(np.int64)
+    return microseconds.astype("timedelta64[us]")
+
+
 def get_range_overlap(r1, r2):
     latest_start = max(r1.start, r2.start)
     earliest_end = min(r1.end, r2.end)
@@ -31,27 +47,82 @@ def get_range_overlap(r1, r2):
 
 
 def get_weighted_prediction(data):
-    preds = {}
+    """Class with the highest probability summed over all frames of a multiclass log.
+
+    `data` is the log's `LogFrames` or its legacy list of records. Ties go to the class
+    listed last in the log, None if the log has no class probabilities.
+    """
+    if not isinstance(data, LogFrames):
+        data = _records_to_frames(data)
+    return get_weighted_predictions([data])[0]
+
+
+def get_weighted_predictions(frames):
+    """`get_weighted_prediction` for many logs, e.g. all logs of a tape-day, in one call.
+
+    Logs listing the same classes are stacked into one ``class_probs`` matrix and summed
+    per log with a single `np.add.reduceat`, missing probabilities count as 0. The
+    prediction of a log without frames is None.
+    """
+    frames = list(frames)
+    predictions = [None] * len(frames)
+    groups = {}
+    for i, f in enumerate(frames):
+        if len(f) and len(f.class_names):
+            groups.setdefault(tuple(f.class_names), []).append(i)
+    for class_names, members in groups.items():
+        lengths = np.array([len(frames[i]) for i in members], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths[:-1])])
+        probs = np.nan_to_num(np.concatenate([frames[i].class_probs for i in members]), nan=0.0)
+        sums = np.add.reduceat(probs, offsets, axis=0)
+        # The last of equal sums wins, like the stable sort of the per-record implementation.
+        top = sums.shape[1] - 1 - np.argmax(sums[:, ::-1], axis=1)
+        for i, j in zip(members, top.tolist()):
+            predictions[i] = class_names[j]
+    return predictions
+
+
+def _records_to_frames(data):
+    class_names = {}
     for p in data:
         for cl in p["classes"]:
-            if cl not in preds:
-                preds[cl] = 0
-            preds[cl] += p["classes"][cl]
-    sorted_preds = {k: v for k, v in sorted(preds.items(), key=lambda item: item[1])}
-    top_prediction = list(sorted_preds.keys())[-1]
-    return top_prediction
-
-
-def get_ground_truth(table, binary_log, multiclass_log):
-    pred_offset = (binary_log.start_date_time - table.start_date_time).total_seconds()
-    prediction_start = multiclass_log.start_date_time + timedelta(seconds=multiclass_log.binary_start)
-    prediction_end = multiclass_log.start_date_time + timedelta(seconds=multiclass_log.binary_end)
-    r1 = Range(start=prediction_start, end=prediction_end)
-    for entry in table.data.itertuples():
+            class_names.setdefault(cl, len(class_names))
+    class_probs = np.full((len(data), len(class_names)), np.nan)
+    for row, p in enumerate(data):
+        for cl, value in p["classes"].items():
+            class_probs[row, class_names[cl]] = value
+    n = len(data)
+    return LogFrames(np.zeros(n), np.zeros(n), np.zeros(n, dtype=np.int64), np.zeros(n),
+                     class_probs=class_probs, class_names=list(class_names))
+
+
+def get_ground_truth(table, multiclass_log):
+    """The first row of the table overlapping the binary detection of the log, see `get_ground_truths`."""
+    return get_ground_truths(table, [multiclass_log])[0]
+
+
+def get_ground_truths(table, multiclass_logs):
+    """`get_ground_truth` for all multiclass logs of one selection table in a single lookup.
+
+    Returns an ``(entry, prediction_range, entry_range)`` tuple per log, where entry is the
+    first row of the table that overlaps the prediction, or None.
+    """
+    pred_ranges = []
+    for multiclass_log in multiclass_logs:
+        prediction_start = multiclass_log.start_date_time + timedelta(seconds=multiclass_log.binary_start)
+        prediction_end = multiclass_log.start_date_time + timedelta(seconds=multiclass_log.binary_end)
+        pred_ranges.append(Range(start=prediction_start, end=prediction_end))
+    rows = table.find_overlaps([r.start for r in pred_ranges], [r.end for r in pred_ranges])
+    matched = np.unique(rows[rows >= 0])
+    entries = dict(zip(matched.tolist(), table.data.iloc[matched].itertuples()))
+
+    results = []
+    for row, r1 in zip(rows.tolist(), pred_ranges):
+        if row < 0:
+            results.append((None, r1, None))
+            continue
+        entry = entries[row]
         entry_start = table.start_date_time + timedelta(seconds=entry[4])
         entry_end = table.start_date_time + timedelta(seconds=entry[5])
-        r2 = Range(start=entry_start, end=entry_end)
-        overlap = get_range_overlap(r1, r2)
-        if overlap > 0:
-            return entry, r1, r2
-    return None, r1, None
+        results.append((entry, r1, Range(start=entry_start, end=entry_end)))
+    return results